@@ -1,9 +1,23 @@
 import os
+import sys
+import asyncio
 from mistralai import Mistral
 import discord
-import requests
+import aiohttp
 import datetime
 import json
+import time
+import re
+import sqlite3
+import random
+import zlib
+import atexit
+import threading
+import hashlib
+import math
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager, nullcontext
+from types import MappingProxyType
 import os.path
 from urllib.parse import quote
 import smtplib
@@ -11,6 +25,8 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 MISTRAL_MODEL = "mistral-large-latest"
+# Stream debate replies so they can be posted before the completion finishes
+MISTRAL_STREAM = os.getenv("MISTRAL_STREAM", "true").lower() == "true"
 SYSTEM_PROMPT = """You are EchoBreaker, a debate bot that takes VERY STRONG political positions to engage users in thoughtful debate.
 
 When a debate starts:
@@ -29,20 +45,316 @@ During the debate:
 
 Your purpose is to help users practice debating against strong viewpoints they disagree with, providing a challenging but educational sparring partner."""
 
+NEWS_API_BASE_URL = "https://newsapi.org/v2/"
+NEWS_API_TIMEOUT = float(os.getenv("NEWS_API_TIMEOUT", "10"))
+NEWS_CACHE_TTL = float(os.getenv("NEWS_CACHE_TTL", "1800"))
+NEWS_CACHE_SIZE = int(os.getenv("NEWS_CACHE_SIZE", "256"))
+NEWS_CACHE_STALE_WHILE_REVALIDATE = os.getenv("NEWS_CACHE_STALE_WHILE_REVALIDATE", "true").lower() == "true"
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a time-to-live"""
+
+    def __init__(self, ttl, max_size=256):
+        self.ttl = ttl
+        self.max_size = max_size
+        # Maps key -> (value, expires_at), least recently used first
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        return list(self._entries)
+
+    def lookup(self, key, max_stale=0):
+        """
+        Look up a key, allowing entries up to max_stale seconds past their expiry.
+        Returns a (value, is_fresh) tuple, or (None, False) on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+
+        value, expires_at = entry
+        now = time.time()
+        if now > expires_at + max_stale:
+            del self._entries[key]
+            self._evicted(key)
+            self.misses += 1
+            return None, False
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value, now <= expires_at
+
+    def get(self, key):
+        """Return the fresh value for a key, or None"""
+        value, is_fresh = self.lookup(key)
+        return value if is_fresh else None
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entries if full"""
+        self._entries[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._evicted(self._entries.popitem(last=False)[0])
+
+    def _evicted(self, key):
+        """Called when an entry is dropped for being expired or least recently used"""
+
+    def peek(self, key):
+        """Return the fresh value for a key without touching LRU order or counters"""
+        entry = self._entries.get(key)
+        if entry is None or time.time() > entry[1]:
+            return None
+        return entry[0]
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight call"""
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def run(self, key, coro_fn, *args):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn(*args))
+            self._calls[key] = task
+
+            def forget(finished, key=key):
+                if self._calls.get(key) is finished:
+                    del self._calls[key]
+            task.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+
+        # Shield the shared call so one cancelled caller doesn't cancel the others
+        return await asyncio.shield(task)
+
+# Messages a user sends within this many seconds of each other are answered as one turn
+TURN_DEBOUNCE_SECONDS = float(os.getenv("TURN_DEBOUNCE_SECONDS", "1.5"))
+
+class TurnQueue:
+    """
+    Serializes turns on each conversation. A message starts a debounce
+    window; messages arriving before its turn begins are merged into it.
+    """
+
+    def __init__(self, debounce=TURN_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self._pending = {}  # key -> messages waiting for the next turn
+        self._locks = defaultdict(asyncio.Lock)
+        self.turns = 0
+        self.merged = 0
+
+    @asynccontextmanager
+    async def turn(self, key, message):
+        """
+        Queue a message for key's next turn. Yields the messages to handle
+        as one turn while no other turn on key runs, or None if the message
+        was merged into a turn another caller is waiting to run.
+        """
+        batch = self._pending.get(key)
+        if batch is not None:
+            batch.append(message)
+            self.merged += 1
+            yield None
+            return
+
+        batch = self._pending[key] = [message]
+        await asyncio.sleep(self.debounce)
+        async with self._locks[key]:
+            # Messages sent while the previous turn ran have joined this batch too
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+            self.turns += 1
+            yield batch
+
+ARTICLE_INDEX_PATH = os.getenv("ARTICLE_INDEX_PATH", "article_index.db")
+# Relevance penalty per day of article age when ranking local search results
+ARTICLE_INDEX_RECENCY_WEIGHT = float(os.getenv("ARTICLE_INDEX_RECENCY_WEIGHT", "0.2"))
+
+class ArticleIndex:
+    """
+    On-disk store of every article seen, with an SQLite FTS5 full-text index.
+    Methods block on disk I/O, so async callers run them with asyncio.to_thread;
+    a lock keeps those threads from sharing the connection at the same time.
+    """
+
+    def __init__(self, path=ARTICLE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS articles (
+                id INTEGER PRIMARY KEY,
+                url TEXT UNIQUE,
+                data TEXT NOT NULL,
+                published_at TEXT
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(title, description, content);
+        """)
+        self.conn.commit()
+
+    def add_articles(self, articles):
+        """Store articles and (re)index them, keyed by URL"""
+        with self._lock, self.conn:
+            for article in articles:
+                url = article.get("url")
+                title = article.get("title")
+                if not url or not title or title == "[Removed]":
+                    continue
+                row_id = self.conn.execute(
+                    "INSERT INTO articles (url, data, published_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(url) DO UPDATE SET data = excluded.data, published_at = excluded.published_at "
+                    "RETURNING id",
+                    (url, json.dumps(article), article.get("publishedAt"))
+                ).fetchone()[0]
+                self.conn.execute("DELETE FROM articles_fts WHERE rowid = ?", (row_id,))
+                self.conn.execute(
+                    "INSERT INTO articles_fts (rowid, title, description, content) VALUES (?, ?, ?, ?)",
+                    (row_id, title, article.get("description") or "", article.get("content") or "")
+                )
+
+    def search(self, query, since=None, limit=1):
+        """
+        Find stored articles matching every word of the query, ranked by
+        BM25 relevance (title weighted highest) and recency.
+        """
+        terms = re.findall(r"\w+", query.lower())
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"' for term in terms)
+
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT a.data FROM articles_fts "
+                "JOIN articles a ON a.id = articles_fts.rowid "
+                "WHERE articles_fts MATCH ? AND (? IS NULL OR a.published_at >= ?) "
+                "ORDER BY bm25(articles_fts, 10.0, 5.0, 1.0) "
+                "    + ? * COALESCE(julianday('now') - julianday(a.published_at), 7) "
+                "LIMIT ?",
+                (match, since, since, ARTICLE_INDEX_RECENCY_WEIGHT, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
 class NewsAgent:
     def __init__(self):
         NEWS_API_KEY = os.getenv("NEWS_API_KEY")
-        self.NEWS_API_KEY = NEWS_API_KEY   
+        self.NEWS_API_KEY = NEWS_API_KEY
+        self.timeout = NEWS_API_TIMEOUT
+        # Shared keep-alive connection pool, created lazily on the running event loop
+        self._session = None
+        # Article lists keyed by (endpoint, normalized query, date window)
+        self.cache = TTLCache(NEWS_CACHE_TTL, NEWS_CACHE_SIZE)
+        self.stale_while_revalidate = NEWS_CACHE_STALE_WHILE_REVALIDATE
+        # Background refreshes of stale entries, keyed like the cache, so they aren't garbage collected mid-run
+        self._refreshing = {}
+        # Local full-text index of every article we've fetched
+        self.article_index = ArticleIndex()
+        # Identical concurrent queries share a single API call
+        self._flights = SingleFlight()
+
+    async def _get_session(self):
+        """Return the pooled HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60)
+            )
+        return self._session
+
+    async def close(self):
+        """Close the pooled HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _date_window(self):
+        """Start of the 7-day window searched by every request"""
+        return (datetime.date.today() - datetime.timedelta(days=7)).isoformat()
+
+    def _cache_key(self, endpoint, query=None):
+        normalized_query = " ".join(query.lower().split()) if query else ""
+        return (endpoint, normalized_query, self._date_window())
+
+    def _build_params(self, endpoint, query=None):
+        """Build the NewsAPI query parameters shared by every endpoint"""
+        params = {
+            "from": self._date_window(),
+            "sortBy": "popularity",
+            "apiKey": self.NEWS_API_KEY,
+        }
+        if endpoint == "top-headlines":
+            params["country"] = "us"
+        if query:
+            params["q"] = query
+        return params
+
+    async def _request(self, endpoint, query=None, timeout=None, fresh=False):
+        """
+        Get articles from a NewsAPI endpoint, serving from the cache when possible.
+        Pass fresh=True to skip the cache lookup and always hit the API.
+        Returns the list of articles, or an empty list if the request failed.
+        """
+        key = self._cache_key(endpoint, query)
+        if fresh:
+            articles = await self._flights.run(key, self._fetch, endpoint, query, timeout)
+            if articles is None:
+                return []
+            self.cache.set(key, articles)
+            return articles
+
+        max_stale = self.cache.ttl if self.stale_while_revalidate else 0
+        articles, is_fresh = self.cache.lookup(key, max_stale=max_stale)
+
+        if articles is not None:
+            if not is_fresh and key not in self._refreshing:
+                # Serve the stale entry now and refresh it in the background
+                task = asyncio.create_task(self._refresh(key, endpoint, query, timeout))
+                self._refreshing[key] = task
+                task.add_done_callback(lambda _, key=key: self._refreshing.pop(key, None))
+            return articles
+
+        articles = await self._flights.run(key, self._fetch, endpoint, query, timeout)
+        if articles is None:
+            return []
+        self.cache.set(key, articles)
+        return articles
+
+    async def _refresh(self, key, endpoint, query, timeout):
+        """Re-fetch a stale cache entry"""
+        articles = await self._flights.run(key, self._fetch, endpoint, query, timeout)
+        if articles is not None:
+            self.cache.set(key, articles)
+
+    async def _fetch(self, endpoint, query=None, timeout=None):
+        """
+        Fetch articles from a NewsAPI endpoint.
+        Returns the list of articles, or None if the request failed.
+        """
+        session = await self._get_session()
+        try:
+            async with session.get(
+                NEWS_API_BASE_URL + endpoint,
+                params=self._build_params(endpoint, query),
+                timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)
+            ) as response:
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f"Error fetching news from {endpoint}: {e}")
+            return None
 
-    def get_top_article(self):
-        url = ('https://newsapi.org/v2/top-headlines?'
-            'country=us&'
-            'from=' + (datetime.date.today() - datetime.timedelta(days=7)).isoformat() + '&'
-            'sortBy=popularity&'
-            f'apiKey={self.NEWS_API_KEY}')
-        
-        response = requests.get(url).json()
-        
         """
         response
         {
@@ -64,10 +376,31 @@ class NewsAgent:
             ]
         }
         """
-        
+
+        if data.get("status") == "error":
+            print(f"NewsAPI error from {endpoint}: {data.get('message')}")
+            return None
+
+        articles = data.get("articles") or []
+        await asyncio.to_thread(self.article_index.add_articles, articles)
+        return articles
+
+    def _run_sync(self, coro_fn, *args):
+        """Run an async NewsAgent call from synchronous code"""
+        async def runner():
+            try:
+                return await coro_fn(*args)
+            finally:
+                # The session is bound to this temporary event loop
+                await self.close()
+        return asyncio.run(runner())
+
+    async def get_top_article_async(self, timeout=None):
+        articles = await self._request("top-headlines", timeout=timeout)
+
         # Check if articles exist in the response
-        if 'articles' in response and len(response['articles']) > 0:
-            return response['articles'][0]
+        if articles:
+            return articles[0]
         else:
             return {
                 "title": "No articles found",
@@ -76,34 +409,24 @@ class NewsAgent:
                 "url": "",
                 "content": ""
             }
-    
-    def get_related_articles(self, keyword):
-        url = ('https://newsapi.org/v2/everything?'
-            f'q={keyword}&'
-            'from=' + (datetime.date.today() - datetime.timedelta(days=7)).isoformat() + '&'
-            'sortBy=popularity&'
-            f'apiKey={self.NEWS_API_KEY}')
-        
-        response = requests.get(url).json()
-        
-        if 'articles' in response:
-            return response['articles']
-        else:
-            return []
 
-    def get_article_by_topic(self, topic):
+    async def get_top_articles_async(self, timeout=None, fresh=False):
+        """Get the full list of current top headlines"""
+        return await self._request("top-headlines", timeout=timeout, fresh=fresh)
+
+    async def get_related_articles_async(self, keyword, timeout=None):
+        return await self._request("everything", query=keyword, timeout=timeout)
+
+    async def get_article_by_topic_async(self, topic, timeout=None):
         """Get a news article related to the specified topic."""
-        url = ('https://newsapi.org/v2/everything?'
-            f'q={topic}&'
-            'from=' + (datetime.date.today() - datetime.timedelta(days=7)).isoformat() + '&'
-            'sortBy=popularity&'
-            f'apiKey={self.NEWS_API_KEY}')
-        
-        response = requests.get(url).json()
-        
+        # Answer from the local index first and only search NewsAPI on a miss
+        articles = await asyncio.to_thread(self.article_index.search, topic, since=self._date_window())
+        if not articles:
+            articles = await self._request("everything", query=topic, timeout=timeout)
+
         # Check if articles exist in the response
-        if 'articles' in response and len(response['articles']) > 0:
-            return response['articles'][0]
+        if articles:
+            return articles[0]
         else:
             # If no articles found on the topic, return a default message
             return {
@@ -114,6 +437,632 @@ class NewsAgent:
                 "content": ""
             }
 
+    def get_top_article(self):
+        """Synchronous wrapper around get_top_article_async"""
+        return self._run_sync(self.get_top_article_async)
+
+    def get_related_articles(self, keyword):
+        """Synchronous wrapper around get_related_articles_async"""
+        return self._run_sync(self.get_related_articles_async, keyword)
+
+    def get_article_by_topic(self, topic):
+        """Synchronous wrapper around get_article_by_topic_async"""
+        return self._run_sync(self.get_article_by_topic_async, topic)
+
+class HeadlinePrefetcher:
+    """Keeps a warm, rotating pool of debate-ready top headlines"""
+
+    def __init__(self, news_agent, interval=None, max_size=None, max_age=None):
+        self.news_agent = news_agent
+        self.interval = interval or float(os.getenv("HEADLINE_PREFETCH_INTERVAL", "600"))
+        self.max_size = max_size or int(os.getenv("HEADLINE_POOL_SIZE", "50"))
+        # Headlines older than this (seconds since they were fetched) leave the pool
+        self.max_age = max_age or float(os.getenv("HEADLINE_MAX_AGE", "21600"))
+        self.pool = deque()  # In serving order; rotated by next_article
+        # Pooled article keys in the order they were fetched, with their fetch times
+        self._fetched = OrderedDict()
+        self._task = None
+
+    @staticmethod
+    def _article_key(article):
+        return article.get("url") or article.get("title")
+
+    @staticmethod
+    def _is_debate_ready(article):
+        """Skip articles without a usable title and description"""
+        title = article.get("title")
+        return bool(title and article.get("description") and title != "[Removed]")
+
+    def add_articles(self, articles):
+        """Add new, deduplicated articles to the pool. Returns how many were added."""
+        added = 0
+        now = time.time()
+        for article in articles:
+            key = self._article_key(article)
+            if key in self._fetched or not self._is_debate_ready(article):
+                continue
+            self.pool.append(article)
+            self._fetched[key] = now
+            added += 1
+
+        # Trim the pool back to its maximum size, dropping the oldest headlines first
+        while len(self._fetched) > self.max_size:
+            self._evict(next(iter(self._fetched)))
+        self._expire()
+        return added
+
+    def _evict(self, key):
+        del self._fetched[key]
+        for article in self.pool:
+            if self._article_key(article) == key:
+                self.pool.remove(article)
+                break
+
+    def _expire(self):
+        """Drop headlines fetched more than max_age ago"""
+        cutoff = time.time() - self.max_age
+        while self._fetched and next(iter(self._fetched.values())) < cutoff:
+            self._evict(next(iter(self._fetched)))
+
+    async def refresh(self):
+        """Pull the latest top headlines into the pool"""
+        articles = await self.news_agent.get_top_articles_async(fresh=True)
+        return self.add_articles(articles)
+
+    async def _run(self):
+        while True:
+            try:
+                added = await self.refresh()
+                print(f"Headline prefetch added {added} articles (pool size {len(self.pool)})")
+            except Exception as e:
+                print(f"Error prefetching headlines: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the background prefetch loop if it isn't already running"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def next_article(self):
+        """Return the next pooled article in rotation, or None if the pool is empty"""
+        self._expire()
+        if not self.pool:
+            return None
+        article = self.pool[0]
+        self.pool.rotate(-1)
+        return article
+
+PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+PERPLEXITY_TIMEOUT = float(os.getenv("PERPLEXITY_TIMEOUT", "30"))
+PERPLEXITY_MAX_CONCURRENCY = int(os.getenv("PERPLEXITY_MAX_CONCURRENCY", "4"))
+# Check all claims from one message in a single Perplexity request
+FACT_CHECK_BATCH = os.getenv("FACT_CHECK_BATCH", "true").lower() == "true"
+# Stream single-claim fact checks and return as soon as the verdict shows up
+FACT_CHECK_STREAM = os.getenv("FACT_CHECK_STREAM", "true").lower() == "true"
+# After the verdict: "background" finishes reading the explanation, "cancel" drops the stream
+FACT_CHECK_STREAM_DETAILS = os.getenv("FACT_CHECK_STREAM_DETAILS", "background").lower()
+# Which fact-check tiers run: "quick" gives a fast verdict for the reply, "deep" a referenced check
+FACT_CHECK_TIERS = [tier.strip() for tier in os.getenv("FACT_CHECK_TIERS", "quick,deep").lower().split(",") if tier.strip()]
+FACT_CHECK_QUICK_MODEL = os.getenv("FACT_CHECK_QUICK_MODEL", "sonar")
+FACT_CHECK_QUICK_TIMEOUT = float(os.getenv("FACT_CHECK_QUICK_TIMEOUT", "3"))
+FACT_CHECK_QUICK_MAX_TOKENS = int(os.getenv("FACT_CHECK_QUICK_MAX_TOKENS", "8"))
+# Quick checks get their own connection slots, so long deep checks can't use up their latency budget
+FACT_CHECK_QUICK_MAX_CONCURRENCY = int(os.getenv("FACT_CHECK_QUICK_MAX_CONCURRENCY", "4"))
+FACT_CHECK_DEEP_MODEL = os.getenv("FACT_CHECK_DEEP_MODEL", "sonar-medium-online")
+FACT_CHECK_DEEP_TIMEOUT = float(os.getenv("FACT_CHECK_DEEP_TIMEOUT", str(PERPLEXITY_TIMEOUT)))
+# Verdicts are only looked for this far into a reply
+VERDICT_WINDOW = 100
+VERDICT_PATTERN = re.compile(r"Partly True|Needs Context|True|False")
+
+CLAIM_CACHE_PATH = os.getenv("CLAIM_CACHE_PATH", "claim_cache.json")
+CLAIM_CACHE_SIZE = int(os.getenv("CLAIM_CACHE_SIZE", "5000"))
+# New verdicts are written to disk in one batch this many seconds after the first of them
+CLAIM_CACHE_SAVE_DELAY = float(os.getenv("CLAIM_CACHE_SAVE_DELAY", "5"))
+# How long each verdict stays cached, in seconds - settled verdicts live longest
+VERDICT_CACHE_TTLS = {
+    "True": 7 * 24 * 3600,
+    "False": 7 * 24 * 3600,
+    "Partly True": 3 * 24 * 3600,
+    "Needs Context": 24 * 3600,
+    "Needs verification": 3600
+}
+
+def _canonical_number(match):
+    """Drop thousands separators and trailing decimal zeros from a number"""
+    number = match.group(0).replace(",", "")
+    if "." in number:
+        number = number.rstrip("0").rstrip(".")
+    return number
+
+def normalize_claim(claim):
+    """
+    Normalize a claim so trivially different phrasings share one key:
+    case-folded, numbers canonicalized, punctuation and extra whitespace removed.
+    """
+    text = claim.casefold()
+    text = re.sub(r"\s*\bper\s?cent\b", "%", text)
+    text = re.sub(r"\d[\d,]*(?:\.\d+)?", _canonical_number, text)
+    # Keep percent signs and decimal points inside numbers, drop other punctuation
+    text = re.sub(r"[^\w\s%.]|(?<!\d)\.|\.(?!\d)", " ", text)
+    return " ".join(text.split())
+
+class ClaimVerdictCache(TTLCache):
+    """LRU cache of fact-check results keyed by normalized claim, persisted to disk"""
+
+    def __init__(self, file_path=CLAIM_CACHE_PATH, max_size=CLAIM_CACHE_SIZE, save_delay=CLAIM_CACHE_SAVE_DELAY,
+                 on_evict=None):
+        super().__init__(ttl=VERDICT_CACHE_TTLS["Needs verification"], max_size=max_size)
+        self.file_path = file_path
+        self.on_evict = on_evict
+        self.save_delay = save_delay
+        self._save_pending = False
+        self._save_lock = threading.Lock()
+        self._load()
+        # Don't lose verdicts still waiting for their batched save
+        atexit.register(self._save_if_pending)
+
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            print(f"Error loading claim cache: {e}")
+            return
+
+        now = time.time()
+        for key, (result, expires_at) in saved.items():
+            if expires_at > now:
+                self._entries[key] = (result, expires_at)
+        # Entries are saved least recently used first, so keep the most recent ones
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _evicted(self, key):
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def _snapshot(self):
+        return {key: [result, expires_at] for key, (result, expires_at) in self._entries.items()}
+
+    def _save(self, snapshot):
+        """Write a snapshot to disk atomically, so a crash mid-write can't corrupt the cache"""
+        temp_path = f"{self.file_path}.tmp"
+        try:
+            with self._save_lock:
+                with open(temp_path, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(temp_path, self.file_path)
+        except Exception as e:
+            print(f"Error saving claim cache: {e}")
+
+    def _schedule_save(self):
+        """Save soon, off the event loop, batching the verdicts added in the meantime"""
+        if self._save_pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._save(self._snapshot())
+            return
+        self._save_pending = True
+        loop.call_later(self.save_delay, self._flush, loop)
+
+    def _flush(self, loop):
+        self._save_pending = False
+        loop.run_in_executor(None, self._save, self._snapshot())
+
+    def _save_if_pending(self):
+        if self._save_pending:
+            self._save_pending = False
+            self._save(self._snapshot())
+
+    def add_result(self, key, result):
+        """Cache a successful fact-check result with a verdict-dependent TTL"""
+        # The raw response duplicates the explanation, so don't persist it twice
+        result = {k: v for k, v in result.items() if k not in ("raw_response", "details")}
+        self.set(key, result, ttl=VERDICT_CACHE_TTLS.get(result["verdict"], self.ttl))
+        self._schedule_save()
+
+CLAIM_SIMILARITY_THRESHOLD = float(os.getenv("CLAIM_SIMILARITY_THRESHOLD", "0.85"))
+
+# Phrases that attribute a claim rather than state it
+CLAIM_ATTRIBUTION_PHRASES = re.compile(
+    r"\b(?:according to|studies (?:show|suggest|found)|research (?:indicates|shows|suggests|found)|"
+    r"data (?:shows|suggests|indicates)|statistics (?:show|indicate)|evidence (?:suggests|shows)|"
+    r"reports? (?:show|shows|say|says)|it is a fact that)\b"
+)
+CLAIM_STOPWORDS = frozenset(
+    "a an the by of in on at to for from with as is are was were be been that this these those "
+    "it its has have had than then and or over about around nearly roughly approximately".split()
+)
+# Collapse common paraphrases of direction onto one token
+CLAIM_SYNONYMS = {
+    **dict.fromkeys(["rose", "rise", "rises", "risen", "increased", "increases", "grew", "grow", "grows",
+                     "grown", "climbed", "jumped", "up", "higher", "surged"], "increase"),
+    **dict.fromkeys(["fell", "fall", "falls", "fallen", "decreased", "decreases", "declined", "decline",
+                     "declines", "dropped", "drop", "drops", "down", "lower", "shrank"], "decrease"),
+}
+# Words that flip a claim's meaning; near-duplicates may not differ in any of them.
+# Normalization splits "isn't" into "isn t", so a lone "t" marks a contraction.
+CLAIM_NEGATIONS = frozenset("not no never nor none neither nobody nothing without cannot t".split())
+CLAIM_DIRECTION_WORDS = frozenset(
+    "increase decrease more less fewer most least above below under greater smaller larger bigger "
+    "best worst better worse gained lost doubled halved tripled".split()
+)
+
+class ClaimLSHIndex:
+    """
+    Locality-sensitive hashing index over previously verified claims.
+    Claims are reduced to MinHash signatures over word shingles and bucketed
+    by band, so near-duplicate lookups only compare against a handful of candidates.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold=CLAIM_SIMILARITY_THRESHOLD, num_perm=64, bands=16, shingle_size=2, max_candidates=64):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_candidates = max_candidates
+        rng = random.Random(153)
+        self._perms = [(rng.randrange(1, self._PRIME), rng.randrange(0, self._PRIME)) for _ in range(num_perm)]
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+        # Maps claim key -> (shingles, words, band keys)
+        self._claims = {}
+
+    def __len__(self):
+        return len(self._claims)
+
+    def _tokens(self, normalized_claim):
+        text = CLAIM_ATTRIBUTION_PHRASES.sub(" ", normalized_claim)
+        return [CLAIM_SYNONYMS.get(word, word) for word in text.split() if word not in CLAIM_STOPWORDS]
+
+    def _shingles(self, tokens):
+        k = self.shingle_size
+        if len(tokens) <= k:
+            return frozenset([" ".join(tokens)])
+        return frozenset(" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1))
+
+    def _signature(self, shingles):
+        hashes = [zlib.crc32(shingle.encode()) for shingle in shingles]
+        prime = self._PRIME
+        return [min((a * h + b) % prime for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [tuple(signature[i * rows:(i + 1) * rows]) for i in range(self.bands)]
+
+    def add(self, key, normalized_claim):
+        """Index a verified claim under its cache key"""
+        if key in self._claims:
+            return
+        tokens = self._tokens(normalized_claim)
+        if not tokens:
+            return
+        shingles = self._shingles(tokens)
+        band_keys = self._band_keys(self._signature(shingles))
+        self._claims[key] = (shingles, frozenset(tokens), band_keys)
+        for bucket, band_key in zip(self._buckets, band_keys):
+            bucket[band_key].append(key)
+
+    def remove(self, key):
+        """Drop a claim, e.g. once its verdict has left the cache"""
+        entry = self._claims.pop(key, None)
+        if entry is None:
+            return
+        for bucket, band_key in zip(self._buckets, entry[2]):
+            keys = bucket[band_key]
+            keys.remove(key)
+            if not keys:
+                del bucket[band_key]
+
+    @staticmethod
+    def _conflicts(words, other_words):
+        """Whether two claims differ in a number, a negation or a direction of change"""
+        differing = words ^ other_words
+        return any(word in CLAIM_NEGATIONS or word in CLAIM_DIRECTION_WORDS or any(c.isdigit() for c in word)
+                   for word in differing)
+
+    def find_similar(self, normalized_claim):
+        """
+        Return (key, similarity) for the most similar indexed claim at or above
+        the threshold, or (None, 0.0). Claims must mention exactly the same numbers
+        and may not differ in negation or direction of change.
+        """
+        tokens = self._tokens(normalized_claim)
+        if not tokens:
+            return None, 0.0
+        shingles = self._shingles(tokens)
+        words = frozenset(tokens)
+
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(self._signature(shingles))):
+            for key in bucket.get(band_key, ()):
+                candidates.add(key)
+                if len(candidates) >= self.max_candidates:
+                    break
+            if len(candidates) >= self.max_candidates:
+                break
+
+        best_key, best_similarity = None, 0.0
+        for key in candidates:
+            other_shingles, other_words, _ = self._claims[key]
+            if self._conflicts(words, other_words):
+                continue
+            similarity = len(shingles & other_shingles) / len(shingles | other_shingles)
+            if similarity > best_similarity:
+                best_key, best_similarity = key, similarity
+
+        if best_similarity >= self.threshold:
+            return best_key, best_similarity
+        return None, 0.0
+
+# Heuristics to identify likely factual claims
+CLAIM_INDICATORS = [
+    "according to", "studies show", "research indicates", "statistics show",
+    "% of", "percent of", "data shows", "evidence suggests", "report",
+    "survey", "poll", "analysis", "fact", "figures", "rates", "numbers",
+    "in 2", "increase", "decrease", "rise", "fall", "grew", "declined"
+]
+
+# Words whose trailing period doesn't end a sentence. Everyday words that are
+# also abbreviations ("co", "rep", ...) are left out: a wrong split only
+# shortens a claim, but a wrong merge glues an opinion onto it.
+SENTENCE_ABBREVIATIONS = frozenset(
+    "mr mrs ms dr prof sr jr st vs etc inc ltd corp gov approx "
+    "jan feb mar apr jun jul aug sep sept oct nov dec".split()
+)
+# Abbreviations only when a number follows, as in "No. 5"
+NUMBER_ABBREVIATIONS = frozenset(["no", "nos"])
+
+def _trie_pattern(words):
+    """Build a regex alternation that shares common prefixes, so matching is one pass"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + pattern + ")?" if "" in node else pattern
+
+    return build(trie)
+
+class ClaimExtractor:
+    """
+    Finds sentences that look like factual claims.
+    The claim indicators are compiled into a single prefix-shared regex that
+    scans the whole message once. Sentences are segmented lazily alongside
+    it, without splitting on abbreviations ("U.S.", "Dr.") or decimals
+    ("3.5%"), so extraction stops as soon as it has enough claims.
+    """
+
+    # Sentence-ending punctuation followed by whitespace, or a line break
+    _SENTENCE_END = re.compile(r'[.!?]+(?=["\')\]]*(?:\s|$))|\n+')
+    _NUMBER_NEXT = re.compile(r'\.\s+\d')
+
+    def __init__(self, indicators=CLAIM_INDICATORS, min_length=20):
+        self.min_length = min_length
+        self._indicators = re.compile(_trie_pattern([indicator.lower() for indicator in indicators]))
+
+    @staticmethod
+    def _is_abbreviation(text, start, end):
+        """Whether the word ending at a period is an abbreviation or initial"""
+        word = text[text.rfind(" ", start, end) + 1:end]
+        if "." not in word:
+            if word.lower() in NUMBER_ABBREVIATIONS:
+                return ClaimExtractor._NUMBER_NEXT.match(text, end) is not None
+            return len(word) <= 6 and (word.lower() in SENTENCE_ABBREVIATIONS or (len(word) == 1 and word.isalpha()))
+        return all(part.isalpha() and len(part) <= 2 for part in word.split("."))
+
+    def iter_sentences(self, text):
+        """Yield (start, end) spans of the sentences in a text, without end punctuation"""
+        start = 0
+        for match in self._SENTENCE_END.finditer(text):
+            end = match.start()
+            if match.group() == "." and self._is_abbreviation(text, start, end):
+                continue
+            yield start, end
+            start = match.end()
+        if start < len(text):
+            yield start, len(text)
+
+    def _iter_scored(self, text):
+        """Yield (sentence, indicator_hits) for each sentence long enough to be a claim"""
+        lowered = text.lower()
+        matches = self._indicators.finditer(lowered)
+        match = next(matches, None)
+        for start, end in self.iter_sentences(text):
+            hits = 0
+            while match is not None and match.start() < end:
+                if match.start() >= start:
+                    hits += 1
+                match = next(matches, None)
+            sentence = text[start:end].strip()
+            if len(sentence) > self.min_length:
+                yield sentence, hits
+
+    def score(self, text):
+        """Return (sentence, indicator_hits) for every sentence long enough to be a claim"""
+        return list(self._iter_scored(text))
+
+    def extract(self, text, max_claims=2):
+        """Return up to max_claims sentences containing a claim indicator, in message order"""
+        claims = []
+        if max_claims <= 0:
+            return claims
+        for sentence, hits in self._iter_scored(text):
+            if hits:
+                claims.append(sentence)
+                if len(claims) == max_claims:
+                    break
+        return claims
+
+    def score_batch(self, texts):
+        """Score many messages at once"""
+        return [self.score(text) for text in texts]
+
+    def extract_batch(self, texts, max_claims=2):
+        """Extract claims from many messages at once"""
+        return [self.extract(text, max_claims) for text in texts]
+
+CLAIM_LOG_PATH = os.getenv("CLAIM_LOG_PATH", "claim_verdicts.jsonl")
+CHECKWORTHINESS_MODEL_PATH = os.getenv("CHECKWORTHINESS_MODEL_PATH", "checkworthiness_model.json")
+CHECKWORTHINESS_THRESHOLD = float(os.getenv("CHECKWORTHINESS_THRESHOLD", "0.5"))
+# Maximum number of claims fact checked per message
+CLAIM_CHECK_BUDGET = int(os.getenv("CLAIM_CHECK_BUDGET", "2"))
+# Verdicts that count as a useful fact check when training the check-worthiness model
+USEFUL_VERDICTS = ("True", "False", "Partly True")
+
+OPINION_MARKERS = frozenset(
+    "i i'm i've we think believe feel should must ought opinion honestly clearly obviously "
+    "wrong right ridiculous absurd better worse".split()
+)
+
+class CheckWorthinessModel:
+    """
+    Logistic regression over hashed sentence features that estimates how
+    likely a candidate sentence is to get a useful (not "Needs Context")
+    fact-check verdict. Weights are sparse, so training and prediction are
+    plain Python with no extra dependencies.
+    Until it's trained, it starts from hand-set weights that mirror the old
+    indicator heuristic.
+    """
+
+    def __init__(self, n_features=1 << 20, path=CHECKWORTHINESS_MODEL_PATH):
+        self.n_features = n_features
+        self.path = path
+        self.bias = -1.0
+        self.weights = {}
+        for feature, weight in {
+            "__indicator__": 1.5,
+            "__number__": 0.8,
+            "__percent__": 0.5,
+            "__year__": 0.5,
+            "__opinion__": -1.0,
+            "__question__": -1.5
+        }.items():
+            self.weights[self._hash(feature)] = weight
+        self.trained = False
+        self.load()
+
+    def _hash(self, feature):
+        return zlib.crc32(feature.encode()) % self.n_features
+
+    def features(self, sentence, indicator_hits=0):
+        """Hashed feature indexes for a sentence"""
+        words = re.findall(r"[a-z0-9%']+", sentence.lower())
+        names = [f"w:{word}" for word in words]
+        names += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        if indicator_hits:
+            names.append("__indicator__")
+        if any(word[0].isdigit() for word in words):
+            names.append("__number__")
+        if "%" in sentence or "percent" in words:
+            names.append("__percent__")
+        if re.search(r"\b(?:19|20)\d\d\b", sentence):
+            names.append("__year__")
+        if any(word in OPINION_MARKERS for word in words):
+            names.append("__opinion__")
+        if sentence.rstrip().endswith("?"):
+            names.append("__question__")
+        names.append(f"__length_{min(len(words) // 10, 5)}__")
+        return [self._hash(name) for name in set(names)]
+
+    def predict(self, sentence, indicator_hits=0):
+        """Probability that checking this sentence yields a useful verdict"""
+        return self._predict_features(self.features(sentence, indicator_hits))
+
+    def _predict_features(self, features):
+        z = self.bias + sum(self.weights.get(f, 0.0) for f in features)
+        z = max(-30.0, min(30.0, z))
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def train(self, examples, epochs=5, learning_rate=0.1, l2=1e-4, seed=153):
+        """Fit the weights with SGD on (sentence, indicator_hits, label) examples"""
+        rows = [(self.features(sentence, hits), label) for sentence, hits, label in examples]
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(rows)
+            for features, label in rows:
+                error = self._predict_features(features) - label
+                self.bias -= learning_rate * error
+                for f in features:
+                    weight = self.weights.get(f, 0.0)
+                    self.weights[f] = weight - learning_rate * (error + l2 * weight)
+        self.trained = True
+
+    def evaluate(self, examples, threshold=CHECKWORTHINESS_THRESHOLD):
+        """Precision and recall of 'check this' decisions on labelled examples"""
+        true_pos = false_pos = false_neg = 0
+        for sentence, hits, label in examples:
+            selected = self.predict(sentence, hits) >= threshold
+            true_pos += selected and label
+            false_pos += selected and not label
+            false_neg += (not selected) and label
+        precision = true_pos / max(1, true_pos + false_pos)
+        recall = true_pos / max(1, true_pos + false_neg)
+        return {"precision": precision, "recall": recall, "examples": len(examples)}
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            self.n_features = saved["n_features"]
+            self.bias = saved["bias"]
+            self.weights = {int(f): w for f, w in saved["weights"].items()}
+            self.trained = True
+        except Exception as e:
+            print(f"Error loading check-worthiness model: {e}")
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({"n_features": self.n_features, "bias": self.bias, "weights": self.weights}, f)
+
+def load_claim_log(path=CLAIM_LOG_PATH):
+    """Read logged fact checks as (sentence, indicator_hits, useful) training examples"""
+    extractor = ClaimExtractor()
+    examples = []
+    if not os.path.exists(path):
+        return examples
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            hits = sum(hits for _, hits in extractor.score(entry["claim"])) if len(entry["claim"]) > extractor.min_length else 0
+            examples.append((entry["claim"], hits, entry["verdict"] in USEFUL_VERDICTS))
+    return examples
+
+def latency_summary(latencies):
+    """Count, mean, p50 and p95 of a collection of latencies"""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean": sum(latencies) / len(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    }
+
 class FactChecker:
     def __init__(self):
         self.PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
@@ -121,15 +1070,239 @@ class FactChecker:
             "Authorization": f"Bearer {self.PERPLEXITY_API_KEY}",
             "Content-Type": "application/json"
         }
+        self.timeout = FACT_CHECK_DEEP_TIMEOUT
+        self.tiers = FACT_CHECK_TIERS
+        self.quick_model = FACT_CHECK_QUICK_MODEL
+        self.quick_timeout = FACT_CHECK_QUICK_TIMEOUT
+        self.deep_model = FACT_CHECK_DEEP_MODEL
+        self.tier_latency = {"quick": deque(maxlen=1000), "deep": deque(maxlen=1000)}
+        self.batch = FACT_CHECK_BATCH
+        self.stream = FACT_CHECK_STREAM
+        self.stream_details = FACT_CHECK_STREAM_DETAILS
+        self.time_to_verdict = deque(maxlen=1000)
+        self.claim_extractor = ClaimExtractor()
+        self.checkworthiness = CheckWorthinessModel()
+        self.checkworthiness_threshold = CHECKWORTHINESS_THRESHOLD
+        self.claim_budget = CLAIM_CHECK_BUDGET
+        self.semaphore = asyncio.Semaphore(PERPLEXITY_MAX_CONCURRENCY)
+        self.quick_semaphore = asyncio.Semaphore(FACT_CHECK_QUICK_MAX_CONCURRENCY)
+        self._session = None
+        # Identical concurrent claims share a single Perplexity call
+        self._flights = SingleFlight()
+        # Near-duplicate matching over the cached claims
+        self.similar_claims = ClaimLSHIndex()
+        # Verdicts for previously checked claims, kept across restarts
+        self.verdict_cache = ClaimVerdictCache(on_evict=self.similar_claims.remove)
+        for key in self.verdict_cache.keys():
+            self.similar_claims.add(key, key)
+        self.calls_avoided = 0
+
+    async def _get_session(self):
+        """Return the pooled HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=PERPLEXITY_MAX_CONCURRENCY + FACT_CHECK_QUICK_MAX_CONCURRENCY, keepalive_timeout=60
+                )
+            )
+        return self._session
+
+    async def close(self):
+        """Close the pooled HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     async def check_claim(self, claim):
         """
         Use Perplexity API to check a factual claim.
         Returns a dict with verification results.
         """
+        key = normalize_claim(claim)
+        cached = self._cached_result(key)
+        if cached is not None:
+            return cached
+        return await self._flights.run(key, self._check_and_cache, key, claim)
+
+    def _cached_result(self, key):
+        """Return a cached verdict for the claim or a near-duplicate of it, or None"""
+        cached = self.verdict_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Reuse the verdict of a near-duplicate claim if one is close enough
+        similar_key, similarity = self.similar_claims.find_similar(key)
+        if similar_key is not None:
+            similar = self.verdict_cache.peek(similar_key)
+            if similar is not None:
+                self.calls_avoided += 1
+                return {**similar, "matched_claim": similar_key, "similarity": similarity}
+            # Its verdict expired without being looked up directly
+            self.similar_claims.remove(similar_key)
+        return None
+
+    async def _check_and_cache(self, key, claim):
+        started = time.monotonic()
+        result = await self._check_claim(claim)
+        details = result.get("details")
+        if details is None:
+            self.tier_latency["deep"].append(time.monotonic() - started)
+        else:
+            # A streamed check returns at its verdict; the call itself lasts until the details are read
+            details.add_done_callback(lambda _: self.tier_latency["deep"].append(time.monotonic() - started))
+        self._cache_result(key, claim, result)
+        return result
+
+    def _cache_result(self, key, claim, result):
+        details = result.get("details")
+        if details is not None:
+            # Cache the full result once the rest of the streamed reply arrives
+            def cache_details(task):
+                if not task.cancelled() and task.exception() is None:
+                    self._cache_result(key, claim, task.result())
+            details.add_done_callback(cache_details)
+            return
+        if result["success"]:
+            self.verdict_cache.add_result(key, result)
+            self.similar_claims.add(key, key)
+            self._log_verdict(claim, result["verdict"])
+
+    def _log_verdict(self, claim, verdict):
+        """Append a fresh verdict to the log used to train the check-worthiness model"""
+        try:
+            with open(CLAIM_LOG_PATH, 'a') as f:
+                f.write(json.dumps({"claim": claim, "verdict": verdict, "time": time.time()}) + "\n")
+        except Exception as e:
+            print(f"Error logging claim verdict: {e}")
+
+    def verdict_latency_stats(self):
+        """Time-to-verdict for streamed fact checks, in seconds"""
+        return latency_summary(self.time_to_verdict)
+
+    def tier_latency_stats(self):
+        """Latency of each fact-check tier's API calls, in seconds"""
+        return {tier: latency_summary(latencies) for tier, latencies in self.tier_latency.items()}
+
+    def cache_stats(self):
+        """Hit and miss counters for the claim verdict cache and near-duplicate matching"""
+        return {
+            **self.verdict_cache.stats(),
+            "similar_claims_indexed": len(self.similar_claims),
+            "calls_avoided": self.calls_avoided
+        }
+
+    async def _complete(self, prompt, model=None, timeout=None, max_tokens=None, semaphore=None):
+        """
+        Send a single-prompt completion request to Perplexity, holding a slot
+        of semaphore (the deep tier's by default) while it runs.
+        Returns {"success": True, "text": ...} or an error dict.
+        """
         if not self.PERPLEXITY_API_KEY:
             return {"success": False, "error": "No API key found for Perplexity"}
         
+        payload = {
+            "model": model or self.deep_model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": False
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        
+        try:
+            session = await self._get_session()
+            # Cap in-flight Perplexity calls across every debate
+            async with semaphore or self.semaphore:
+                async with session.post(
+                    PERPLEXITY_API_URL,
+                    headers=self.headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)
+                ) as response:
+                    if response.status != 200:
+                        return {
+                            "success": False,
+                            "error": f"API request failed with status code {response.status}",
+                            "response": await response.text()
+                        }
+                    result = await response.json()
+
+            return {"success": True, "text": result["choices"][0]["message"]["content"]}
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    async def _stream(self, prompt, model=None):
+        """Stream a single-prompt completion from Perplexity, yielding text deltas"""
+        if not self.PERPLEXITY_API_KEY:
+            raise RuntimeError("No API key found for Perplexity")
+        
+        session = await self._get_session()
+        async with self.semaphore:
+            async with session.post(
+                PERPLEXITY_API_URL,
+                headers=self.headers,
+                json={
+                    "model": model or self.deep_model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "stream": True
+                },
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"API request failed with status code {response.status}")
+                
+                # Server-sent events: one "data: {...}" line per chunk
+                async for line in response.content:
+                    line = line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+
+    async def _check_claim_streaming(self, prompt):
+        """
+        Stream a fact check and return as soon as the verdict is known.
+        The rest of the reply is either read in the background (the result's
+        "details" task resolves to the full result) or the stream is cancelled.
+        """
+        started = time.monotonic()
+        verdict_ready = asyncio.get_running_loop().create_future()
+        
+        async def read():
+            text = ""
+            async for delta in self._stream(prompt):
+                text += delta
+                if not verdict_ready.done() and (self._find_verdict(text) or len(text) >= VERDICT_WINDOW):
+                    verdict_ready.set_result(text)
+            if not verdict_ready.done():
+                verdict_ready.set_result(text)
+            return self._parse_fact_check(text)
+        
+        reader = asyncio.ensure_future(read())
+        await asyncio.wait([verdict_ready, reader], return_when=asyncio.FIRST_COMPLETED)
+        if not verdict_ready.done():
+            # The stream failed before a verdict arrived
+            try:
+                return reader.result()
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+        
+        self.time_to_verdict.append(time.monotonic() - started)
+        result = self._parse_fact_check(verdict_ready.result())
+        if reader.done() or self.stream_details != "background":
+            reader.cancel()
+            return result
+        result["details"] = reader
+        return result
+
+    async def _check_claim(self, claim):
         # Format the prompt for fact-checking
         prompt = f"Fact check the following claim and determine if it's accurate. Reply with:\n" \
                  f"1. Whether the claim is True, False, Partly True, or Needs Context\n" \
@@ -137,85 +1310,311 @@ class FactChecker:
                  f"3. References to support your assessment\n\n" \
                  f"Claim: {claim}"
         
+        if self.stream:
+            return await self._check_claim_streaming(prompt)
+        
+        completion = await self._complete(prompt)
+        if not completion["success"]:
+            return completion
+        return self._parse_fact_check(completion["text"])
+
+    async def quick_check(self, claim):
+        """
+        Get a fast, verdict-only answer for a claim within the quick tier's
+        latency budget. Quick verdicts aren't cached; the deep tier's are.
+        """
+        cached = self.verdict_cache.peek(normalize_claim(claim))
+        if cached is not None:
+            return {**cached, "tier": "deep"}
+        
+        prompt = f"Is the following claim True, False, Partly True, or Needs Context? " \
+                 f"Reply with only the verdict.\n\n" \
+                 f"Claim: {claim}"
+        started = time.monotonic()
         try:
-            response = requests.post(
-                "https://api.perplexity.ai/chat/completions",
-                headers=self.headers,
-                json={
-                    "model": "sonar-medium-online",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "stream": False
-                }
+            # The budget covers waiting for a free quick-tier slot, not just the request
+            completion = await asyncio.wait_for(
+                self._complete(prompt, model=self.quick_model, max_tokens=FACT_CHECK_QUICK_MAX_TOKENS,
+                               semaphore=self.quick_semaphore),
+                self.quick_timeout
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                fact_check_text = result["choices"][0]["message"]["content"]
-                
-                # Extract verdict and explanation
-                verdict = "Needs verification"
-                explanation = fact_check_text
-                references = []
-                
-                # Simple parsing of the response
-                if "True" in fact_check_text[:100]:
-                    verdict = "True"
-                elif "False" in fact_check_text[:100]:
-                    verdict = "False"
-                elif "Partly True" in fact_check_text[:100]:
-                    verdict = "Partly True"
-                elif "Needs Context" in fact_check_text[:100]:
-                    verdict = "Needs Context"
-                
-                # Extract references if they exist
-                if "References:" in fact_check_text:
-                    refs_section = fact_check_text.split("References:")[1].strip()
-                    # Simple parsing to extract references
-                    references = [r.strip() for r in refs_section.split("\n") if r.strip()]
-                
-                return {
-                    "success": True,
-                    "verdict": verdict,
-                    "explanation": explanation,
-                    "references": references,
-                    "raw_response": fact_check_text
-                }
+        except asyncio.TimeoutError:
+            completion = {"success": False, "error": "Quick check timed out"}
+        self.tier_latency["quick"].append(time.monotonic() - started)
+        if not completion["success"]:
+            return completion
+        
+        verdict = self._find_verdict(completion["text"])
+        if verdict is None:
+            return {"success": False, "error": "No verdict in quick reply"}
+        return {"success": True, "verdict": verdict, "tier": "quick"}
+
+    async def _check_claims_batched(self, claims):
+        """
+        Check several claims with a single Perplexity request.
+        Returns one result per claim, or None if the reply couldn't be parsed.
+        """
+        prompt = "Fact check each of the following claims and determine if it's accurate. " \
+                 "Reply with ONLY a JSON array containing one object per claim, in the same order, with these fields:\n" \
+                 "- claim: the claim number\n" \
+                 "- verdict: exactly one of True, False, Partly True, or Needs Context\n" \
+                 "- explanation: a brief explanation of your assessment\n" \
+                 "- references: a list of references to support your assessment\n\n"
+        for i, claim in enumerate(claims, 1):
+            prompt += f"Claim {i}: {claim}\n"
+
+        started = time.monotonic()
+        completion = await self._complete(prompt)
+        self.tier_latency["deep"].append(time.monotonic() - started)
+        if not completion["success"]:
+            return None
+        return self._parse_batched_fact_check(completion["text"], len(claims))
+
+    def _parse_batched_fact_check(self, text, claim_count):
+        """Parse a batched JSON fact-check reply into one result per claim, or None"""
+        # The array might be wrapped in a markdown code block
+        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
+        json_str = json_match.group(1) if json_match else text
+        json_str = re.sub(r'^[^\[]*', '', json_str)
+        json_str = re.sub(r'[^\]]*$', '', json_str)
+
+        try:
+            items = json.loads(json_str)
+        except ValueError:
+            return None
+        if not isinstance(items, list) or len(items) != claim_count:
+            return None
+
+        results = []
+        for item in items:
+            if not isinstance(item, dict) or item.get("verdict") not in ("True", "False", "Partly True", "Needs Context"):
+                return None
+            references = item.get("references") or []
+            if isinstance(references, str):
+                references = [references]
+            results.append({
+                "success": True,
+                "verdict": item["verdict"],
+                "explanation": str(item.get("explanation", "")),
+                "references": [str(r) for r in references],
+                "raw_response": text
+            })
+        return results
+
+    @staticmethod
+    def _find_verdict(fact_check_text):
+        """
+        Return the first verdict named near the start of a reply, or None.
+        Once a verdict appears, more text can't change it, so streams can stop early.
+        """
+        match = VERDICT_PATTERN.search(fact_check_text[:VERDICT_WINDOW])
+        return match.group() if match else None
+
+    def _parse_fact_check(self, fact_check_text):
+        """Parse a Perplexity fact-check reply into a verification result"""
+        # Extract verdict and explanation
+        verdict = self._find_verdict(fact_check_text) or "Needs verification"
+        explanation = fact_check_text
+        references = []
+        
+        # Extract references if they exist
+        if "References:" in fact_check_text:
+            refs_section = fact_check_text.split("References:")[1].strip()
+            # Simple parsing to extract references
+            references = [r.strip() for r in refs_section.split("\n") if r.strip()]
+        
+        return {
+            "success": True,
+            "verdict": verdict,
+            "explanation": explanation,
+            "references": references,
+            "raw_response": fact_check_text
+        }
+
+    async def check_claims(self, claims):
+        """
+        Check several claims, returning results in claim order.
+        In batch mode, claims that miss the caches share one Perplexity request;
+        otherwise each claim is checked concurrently.
+        """
+        if not self.batch or len(claims) < 2:
+            return await asyncio.gather(*(self.check_claim(claim) for claim in claims))
+
+        keys = [normalize_claim(claim) for claim in claims]
+        results = [self._cached_result(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+
+        if len(misses) == 1:
+            results[misses[0]] = await self.check_claim(claims[misses[0]])
+        elif misses:
+            batched = await self._check_claims_batched([claims[i] for i in misses])
+            if batched is None:
+                # Fall back to one request per claim if the batch reply was unusable;
+                # check_claim caches and logs each of its own results
+                batched = await asyncio.gather(*(self.check_claim(claims[i]) for i in misses))
             else:
-                return {
-                    "success": False,
-                    "error": f"API request failed with status code {response.status_code}",
-                    "response": response.text
-                }
-        except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
+                for i, result in zip(misses, batched):
+                    self._cache_result(keys[i], claims[i], result)
+            for i, result in zip(misses, batched):
+                results[i] = result
+        return results
+
+    def start_checks(self, claims):
+        """Start checking claims in the background, returning one task per claim"""
+        if self.batch and len(claims) > 1:
+            batch = asyncio.ensure_future(self.check_claims(claims))
+
+            async def batch_item(i):
+                return (await batch)[i]
+            return [asyncio.ensure_future(batch_item(i)) for i in range(len(claims))]
+        return [asyncio.ensure_future(self.check_claim(claim)) for claim in claims]
+
+    def start_tiered_checks(self, claims):
+        """
+        Start the configured fact-check tiers for claims in the background.
+        Returns (quick, deep) lists of tasks, one per claim, or empty for a disabled tier.
+        """
+        quick = [asyncio.ensure_future(self.quick_check(claim)) for claim in claims] if "quick" in self.tiers else []
+        deep = self.start_checks(claims) if "deep" in self.tiers else []
+        return quick, deep
     
     def extract_claims(self, text):
         """
         Extract potential factual claims from a message.
         Returns a list of claim strings.
         """
-        # This is a simplified approach - in production, you might use NLP models
-        sentences = [s.strip() for s in text.split('.') if len(s.strip()) > 20]
-        claims = []
-        
-        # Heuristics to identify likely factual claims
-        claim_indicators = [
-            "according to", "studies show", "research indicates", "statistics show",
-            "% of", "percent of", "data shows", "evidence suggests", "report",
-            "survey", "poll", "analysis", "fact", "figures", "rates", "numbers",
-            "in 2", "increase", "decrease", "rise", "fall", "grew", "declined"
-        ]
-        
-        for sentence in sentences:
-            # Check if the sentence contains any claim indicators
-            if any(indicator in sentence.lower() for indicator in claim_indicators):
-                claims.append(sentence)
-        
-        # Limit to 1-2 claims to avoid excessive API usage
-        return claims[:2]
+        # Rank every candidate sentence by how check-worthy it looks
+        ranked = []
+        for sentence, hits in self.claim_extractor.score(text):
+            score = self.checkworthiness.predict(sentence, hits)
+            if score >= self.checkworthiness_threshold:
+                ranked.append((score, sentence))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        
+        # Limit to the per-message budget to avoid excessive API usage
+        return [sentence for _, sentence in ranked[:self.claim_budget]]
+
+DEBATE_LEVELS = ("beginner", "intermediate", "advanced")
+DEFAULT_DEBATE_LEVEL = "intermediate"
+
+_LEVEL_DESCRIPTIONS = {
+    "beginner": {
+        "name": "Beginner",
+        "difficulty": "Easy - I'll be more willing to concede points and use gentler counterarguments",
+        "complexity": "High School level vocabulary and straightforward reasoning",
+        "point_multiplier": 0.8,
+        "features": (
+            "Simpler vocabulary and sentence structure",
+            "More willing to acknowledge your points",
+            "Clearer explanations with concrete examples",
+            "Less aggressive challenging of your arguments"
+        )
+    },
+    "intermediate": {
+        "name": "Intermediate",
+        "difficulty": "Normal - I'll present balanced arguments with moderate intensity",
+        "complexity": "College level vocabulary and nuanced reasoning",
+        "point_multiplier": 1.0,
+        "features": (
+            "Moderate vocabulary and some specialized terms",
+            "Balanced approach to counterarguments",
+            "Mix of theoretical concepts and practical examples",
+            "Firm defense of position with occasional concessions"
+        )
+    },
+    "advanced": {
+        "name": "Advanced",
+        "difficulty": "Hard - I'll aggressively defend my position and thoroughly challenge yours",
+        "complexity": "Professor level vocabulary with sophisticated reasoning",
+        "point_multiplier": 1.2,
+        "features": (
+            "Advanced vocabulary and complex sentence structures",
+            "Aggressive defense of position with minimal concessions",
+            "Sophisticated arguments drawing on multiple disciplines",
+            "Rigorous challenging of your arguments' premises and logic"
+        )
+    }
+}
+# Read-only, so every caller shares the same copy
+LEVEL_DESCRIPTIONS = MappingProxyType({level: MappingProxyType(info) for level, info in _LEVEL_DESCRIPTIONS.items()})
+
+# Per-level instructions, part of every system prompt at that level
+_LEVEL_INSTRUCTIONS = {
+    "beginner": """
+DEBATE LEVEL: BEGINNER
+- Use vocabulary and sentence structures accessible to high school students
+- Present your arguments clearly with straightforward reasoning
+- Be somewhat willing to acknowledge the validity of the user's points
+- Provide concrete examples and simple analogies
+- Challenge the user's arguments gently, focusing on major flaws
+- Keep sentences relatively short and direct
+""",
+    "intermediate": """
+DEBATE LEVEL: INTERMEDIATE
+- Use vocabulary and sentence structures appropriate for college-educated adults
+- Present nuanced arguments that consider multiple perspectives
+- Maintain your position firmly but acknowledge reasonable points
+- Balance theoretical concepts with practical examples
+- Challenge the user's arguments directly but respectfully
+- Use moderately complex sentence structures and rhetorical techniques
+""",
+    "advanced": """
+DEBATE LEVEL: ADVANCED
+- Use advanced vocabulary, complex sentence structures, and sophisticated rhetorical techniques
+- Present complex, multi-layered arguments drawing on interdisciplinary knowledge
+- Aggressively defend your position with minimal concessions
+- Make nuanced distinctions and address subtle counterarguments
+- Rigorously challenge the premises and logic of the user's arguments
+- Use abstract reasoning and hypothetical scenarios to strengthen your position
+"""
+}
+LEVEL_INSTRUCTIONS = MappingProxyType({level: sys.intern(text) for level, text in _LEVEL_INSTRUCTIONS.items()})
+
+# Debate mechanics added to every historical figure's persona prompt
+FIGURE_DEBATE_MECHANICS = """You are participating in a political debate on a current topic.
+Your primary role is to:
+1. Take strong positions and defend them
+2. Challenge the user's arguments with counterpoints
+3. Keep responses concise (under 1000 characters)
+4. Never concede major points or switch sides"""
+
+class PromptRegistry:
+    """
+    System prompts for every (figure, level) pair, built once and shared by
+    every conversation that uses them. None stands for the default persona.
+    Generated figures are added with register(); registering a figure again
+    replaces its prompts.
+    """
+    
+    def __init__(self, figures):
+        self._prompts = {}
+        self.register(None, None)
+        for figure_id, figure in figures.items():
+            self.register(figure_id, figure)
+    
+    def __len__(self):
+        return len(self._prompts)
+    
+    def register(self, figure_id, figure):
+        """Build the prompts for a figure at every debate level, replacing any it already has"""
+        if figure is None:
+            persona_prompt = SYSTEM_PROMPT
+        else:
+            # Create a combined prompt that emphasizes the historical figure's voice
+            persona_prompt = f"""MOST IMPORTANT: {figure['prompt']}
+
+While maintaining the above historical persona completely, also incorporate these debate mechanics:
+{FIGURE_DEBATE_MECHANICS}
+
+Remember, your primary identity is as {figure['name']} - your language, reasoning style, values, and worldview should consistently reflect this historical figure throughout the entire debate. Never break character."""
+        prompts = {(figure_id, level): sys.intern(f"{persona_prompt}\n{LEVEL_INSTRUCTIONS[level]}") for level in DEBATE_LEVELS}
+        # Swap in a new dict so readers never see a figure with only some levels rebuilt
+        self._prompts = {**self._prompts, **prompts}
+    
+    def get(self, figure_id=None, level=DEFAULT_DEBATE_LEVEL):
+        """Return the shared system prompt for a figure and level, falling back to the default persona"""
+        level = level if level in DEBATE_LEVELS else DEFAULT_DEBATE_LEVEL
+        return self._prompts.get((figure_id, level)) or self._prompts[(None, level)]
 
 class HistoricalFigures:
     """Manages historical figure personas for debates"""
@@ -288,6 +1687,8 @@ class HistoricalFigures:
                 "prompt": "You are debating as Franklin D. Roosevelt, the US President during the Great Depression and WWII. Express optimism even in difficult times, advocate for government programs to help ordinary citizens, and emphasize the role of government in ensuring economic security. Occasionally reference your New Deal programs or the fight against fascism. Use warm, reassuring language that conveys confidence."
             }
         }
+        # Persona prompts for every figure and level, shared by all conversations
+        self.prompts = PromptRegistry(self.figures)
     
     def get_figure_names(self):
         """Returns a list of available historical figures"""
@@ -312,34 +1713,16 @@ class HistoricalFigures:
                 
         return None
     
-    def get_prompt_for_figure(self, figure_id):
-        """Returns the specialized prompt for a historical figure"""
-        figure_id = figure_id.lower()
-        if figure_id in self.figures:
-            # Get the base debate functionality but prioritize the historical figure's voice
-            base_prompt = """You are participating in a political debate on a current topic.
-Your primary role is to:
-1. Take strong positions and defend them
-2. Challenge the user's arguments with counterpoints
-3. Keep responses concise (under 1000 characters)
-4. Never concede major points or switch sides"""
-            
-            figure_prompt = self.figures[figure_id]["prompt"]
-            
-            # Create a combined prompt that emphasizes the historical figure's voice
-            combined_prompt = f"""MOST IMPORTANT: {figure_prompt}
-
-While maintaining the above historical persona completely, also incorporate these debate mechanics:
-{base_prompt}
+    def get_prompt_for_figure(self, figure_id, level=DEFAULT_DEBATE_LEVEL):
+        """Returns the specialized prompt for a historical figure at a debate level"""
+        # Falls back to the default prompt if the figure isn't found
+        return self.prompts.get(figure_id.lower(), level)
 
-Remember, your primary identity is as {self.figures[figure_id]['name']} - your language, reasoning style, values, and worldview should consistently reflect this historical figure throughout the entire debate. Never break character."""
-            
-            return combined_prompt
-        return SYSTEM_PROMPT  # Return default prompt if figure not found
-
-    async def generate_custom_figure(self, figure_name, client):
+    async def generate_custom_figure(self, figure_name, client, scheduler=None, user_id=None, guild_id=None, router=None):
         """
-        Dynamically generate a persona for any historical figure requested by the user
+        Dynamically generate a persona for any historical figure requested by the user.
+        If given, the call waits for a background slot on the scheduler and
+        uses the model the router picks for persona generation.
         """
         # Use the Mistral API to generate a custom persona for the requested figure
         prompt = f"""Create a debate persona for the historical figure: {figure_name}.
@@ -356,10 +1739,16 @@ Remember, your primary identity is as {self.figures[figure_id]['name']} - your l
         """
         
         try:
-            response = await client.chat.complete_async(
-                model="mistral-large-latest",
-                messages=[{"role": "user", "content": prompt}]
-            )
+            tier, model = router.route("persona", input_tokens=estimate_tokens(prompt)) if router else ("large", MISTRAL_MODEL)
+            slot = scheduler.slot(PRIORITY_BACKGROUND, user_id, guild_id) if scheduler else nullcontext()
+            async with slot:
+                started = time.monotonic()
+                response = await client.chat.complete_async(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}]
+                )
+                if router:
+                    router.record(tier, time.monotonic() - started, getattr(response, "usage", None))
             
             # Extract the response content
             content = response.choices[0].message.content
@@ -388,8 +1777,10 @@ Remember, your primary identity is as {self.figures[figure_id]['name']} - your l
             underscore_key = figure_name.lower().replace(" ", "_")
             
             self.figures[space_key] = figure_data
+            self.prompts.register(space_key, figure_data)
             if space_key != underscore_key:
                 self.figures[underscore_key] = figure_data
+                self.prompts.register(underscore_key, figure_data)
             
             return underscore_key, figure_data  # Return underscore version for cleaner commands
         
@@ -397,6 +1788,521 @@ Remember, your primary identity is as {self.figures[figure_id]['name']} - your l
             print(f"Error generating custom figure: {e}")
             return None, {"error": str(e)}
 
+def guild_id_of(message):
+    """The guild a Discord message came from, or None for DMs and synthetic messages"""
+    guild = getattr(message, "guild", None)
+    return guild.id if guild else None
+
+def verdict_emoji(verdict):
+    return "✅" if verdict == "True" else "❌" if verdict == "False" else "⚠️"
+
+def format_fact_check_results(fact_check_results):
+    """Format fact-check results for display in Discord"""
+    display = ""
+    for i, check in enumerate(fact_check_results, 1):
+        display += f"📊 **Claim {i}**: \"{check['claim']}\"\n"
+        if check.get("verdict"):
+            display += f"{verdict_emoji(check['verdict'])} **Verdict**: {check['verdict']}"
+            display += " *(quick check, verifying...)*\n\n" if check.get("tier") == "quick" else "\n\n"
+        else:
+            display += f"⏳ **Verdict**: {check.get('status', 'Checking...')}\n\n"
+    return display
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+# The most recent turns are always sent, however long they are
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "3"))
+# Rough characters per token for English text, plus the per-message role/formatting tokens
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKEN_OVERHEAD = 4
+# Evicted turns are folded into a running summary, routed as a "summary" task
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "250"))
+
+def estimate_tokens(text):
+    """Estimate how many tokens a piece of text uses, without a tokenizer"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+class ContextWindow:
+    """
+    Keeps each conversation under a token budget. The leading system messages
+    and the last few turns are always kept; older turns are evicted oldest-first.
+    A turn is a user message plus everything that follows it up to the next one.
+    """
+    
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, keep_turns=CONTEXT_KEEP_TURNS):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.stats = {}
+    
+    @staticmethod
+    def message_tokens(message):
+        return estimate_tokens(message["content"] or "") + MESSAGE_TOKEN_OVERHEAD
+    
+    @staticmethod
+    def _new_stats():
+        return {"turns_evicted": 0, "messages_evicted": 0, "tokens_evicted": 0, "prompt_tokens": 0}
+    
+    def count_tokens(self, messages):
+        return sum(self.message_tokens(message) for message in messages)
+    
+    @staticmethod
+    def split_turns(conversation):
+        """Split a conversation into its leading system messages and a list of turns"""
+        head_size = 0
+        while head_size < len(conversation) and conversation[head_size]["role"] == "system":
+            head_size += 1
+        turns = []
+        for message in conversation[head_size:]:
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return conversation[:head_size], turns
+    
+    def fit(self, key, conversation, token_budget=None):
+        """
+        Evict the oldest turns from a conversation, in place, until it fits the
+        budget (token_budget overrides the default). Returns the evicted
+        messages, oldest first.
+        """
+        stats = self.stats.setdefault(key, self._new_stats())
+        head, turns = self.split_turns(conversation)
+        turn_tokens = [self.count_tokens(turn) for turn in turns]
+        evict, total = self._evict_count(head, turn_tokens, token_budget)
+        
+        evicted = [message for turn in turns[:evict] for message in turn]
+        if evicted:
+            conversation[:] = head + [message for turn in turns[evict:] for message in turn]
+            stats["turns_evicted"] += evict
+            stats["messages_evicted"] += len(evicted)
+            stats["tokens_evicted"] += sum(turn_tokens[:evict])
+        stats["prompt_tokens"] = total
+        return evicted
+    
+    def trimmed(self, conversation, token_budget=None):
+        """Return a copy of a conversation without the turns fit() would evict, leaving it untouched"""
+        head, turns = self.split_turns(conversation)
+        evict, _ = self._evict_count(head, [self.count_tokens(turn) for turn in turns], token_budget)
+        if not evict:
+            return conversation
+        return head + [message for turn in turns[evict:] for message in turn]
+    
+    def _evict_count(self, head, turn_tokens, token_budget=None):
+        """How many of the oldest turns to drop to fit the budget, and the tokens left after"""
+        token_budget = token_budget or self.token_budget
+        total = self.count_tokens(head) + sum(turn_tokens)
+        evict = 0
+        while total > token_budget and len(turn_tokens) - evict > self.keep_turns:
+            total -= turn_tokens[evict]
+            evict += 1
+        return evict, total
+    
+    def get_stats(self, key):
+        """Eviction counters and the latest prompt size for one conversation"""
+        return dict(self.stats.get(key) or self._new_stats())
+    
+    def reset(self, key):
+        self.stats.pop(key, None)
+
+TRANSCRIPT_RECALL_K = int(os.getenv("TRANSCRIPT_RECALL_K", "3"))
+# Earlier turns scoring below this aren't worth the prompt tokens
+TRANSCRIPT_RECALL_MIN_SCORE = float(os.getenv("TRANSCRIPT_RECALL_MIN_SCORE", "2.0"))
+TRANSCRIPT_RECALL_MAX_CHARS = 500
+TRANSCRIPT_STOPWORDS = CLAIM_STOPWORDS | frozenset(
+    "i you we they he she me my your our their not no do does did what which who how why "
+    "but so if just can could would should will about all there here".split()
+)
+
+class TranscriptIndex:
+    """
+    BM25 index over one conversation's past messages, used to recall earlier
+    turns that have scrolled out of the context window
+    """
+    
+    K1 = 1.5
+    B = 0.75
+    
+    def __init__(self):
+        self.messages = []
+        self.lengths = []
+        self.total_length = 0
+        self.postings = defaultdict(dict)  # term -> {message index: term frequency}
+    
+    def __len__(self):
+        return len(self.messages)
+    
+    @staticmethod
+    def tokenize(text):
+        return [token for token in re.findall(r"[a-z0-9']+", text.lower()) if token not in TRANSCRIPT_STOPWORDS]
+    
+    def add(self, message):
+        """Index a conversation message (a role/content dict)"""
+        tokens = self.tokenize(message["content"] or "")
+        if not tokens:
+            return
+        i = len(self.messages)
+        self.messages.append(message)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        for token in tokens:
+            postings = self.postings[token]
+            postings[i] = postings.get(i, 0) + 1
+    
+    def search(self, query, limit=TRANSCRIPT_RECALL_K, min_score=TRANSCRIPT_RECALL_MIN_SCORE, exclude=()):
+        """
+        Return up to limit indexed messages most relevant to query, best first.
+        Messages in exclude (compared by identity) are skipped.
+        """
+        if not self.messages:
+            return []
+        excluded = {id(message) for message in exclude}
+        count = len(self.messages)
+        average_length = self.total_length / count
+        scores = defaultdict(float)
+        for token in set(self.tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings.items():
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[i] / average_length)
+                scores[i] += idf * tf * (self.K1 + 1) / (tf + norm)
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for i, score in ranked:
+            if score < min_score or len(results) >= limit:
+                break
+            if id(self.messages[i]) not in excluded:
+                results.append(self.messages[i])
+        return results
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+PRIORITY_INTERACTIVE = 0  # Debate turns and openings someone is waiting on
+PRIORITY_BACKGROUND = 1   # Summaries, persona generation and other deferrable work
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+class LLMScheduler:
+    """
+    Admits LLM calls up to a concurrency limit. Waiting calls are served
+    by priority, interactive before background, and round-robin across
+    guilds and then across users within a guild, so one busy channel
+    can't starve the others.
+    """
+    
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.running = 0
+        self.admitted = 0
+        # priority -> guild -> user -> waiting futures, guilds and users in round-robin order
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self.wait_times = {priority: deque(maxlen=1000) for priority in PRIORITY_NAMES}
+    
+    def queue_depth(self, priority=None):
+        """Number of calls waiting for a slot, optionally at one priority"""
+        priorities = PRIORITY_NAMES if priority is None else (priority,)
+        return sum(
+            len(waiters)
+            for p in priorities
+            for users in self._queues[p].values()
+            for waiters in users.values()
+        )
+    
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_INTERACTIVE, user_id=None, guild_id=None):
+        """Hold one of the scheduler's slots for the duration of an LLM call"""
+        queued = time.monotonic()
+        if self.running < self.max_concurrency and not self.queue_depth():
+            self.running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            users = self._queues[priority].setdefault(guild_id, OrderedDict())
+            users.setdefault(user_id, deque()).append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just as the caller was cancelled
+                    self._release()
+                else:
+                    self._forget(priority, guild_id, user_id, waiter)
+                raise
+        
+        self.wait_times[priority].append(time.monotonic() - queued)
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self._release()
+    
+    def _release(self):
+        waiter = self._next_waiter()
+        if waiter is None:
+            self.running -= 1
+        else:
+            # Hand the slot straight to the next caller
+            waiter.set_result(None)
+    
+    def _next_waiter(self):
+        for priority in sorted(self._queues):
+            guilds = self._queues[priority]
+            while guilds:
+                guild_id, users = next(iter(guilds.items()))
+                user_id, waiters = next(iter(users.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                if users:
+                    guilds.move_to_end(guild_id)
+                else:
+                    del guilds[guild_id]
+                if not waiter.done():
+                    return waiter
+        return None
+    
+    def _forget(self, priority, guild_id, user_id, waiter):
+        users = self._queues[priority].get(guild_id)
+        waiters = users.get(user_id) if users else None
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del users[user_id]
+            if not users:
+                del self._queues[priority][guild_id]
+    
+    def stats(self):
+        """Running calls, queue depth and time spent waiting for a slot, per priority"""
+        return {
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "admitted": self.admitted,
+            "queued": {name: self.queue_depth(priority) for priority, name in PRIORITY_NAMES.items()},
+            "wait": {name: latency_summary(self.wait_times[priority]) for priority, name in PRIORITY_NAMES.items()}
+        }
+
+def _thresholds(name, default):
+    return [float(value) for value in os.getenv(name, default).split(",")]
+
+# Interactive queue depth and recent wait for a scheduler slot (seconds) at which each degradation stage kicks in.
+# Slot wait tracks load; total reply time mostly tracks reply length and model.
+DEGRADE_QUEUE_THRESHOLDS = _thresholds("DEGRADE_QUEUE_THRESHOLDS", "4,8,12,16")
+DEGRADE_WAIT_THRESHOLDS = _thresholds("DEGRADE_WAIT_THRESHOLDS", "2,4,6,8")
+# Only replies this recent count towards the wait signal
+DEGRADE_WAIT_WINDOW = float(os.getenv("DEGRADE_WAIT_WINDOW", "60"))
+# Seconds to hold a stage before stepping back down, so the stage doesn't flap
+DEGRADE_COOLDOWN = float(os.getenv("DEGRADE_COOLDOWN", "30"))
+DEGRADED_CONTEXT_TOKEN_BUDGET = int(os.getenv("DEGRADED_CONTEXT_TOKEN_BUDGET", "1500"))
+DEGRADED_MAX_TOKENS = int(os.getenv("DEGRADED_MAX_TOKENS", "300"))
+DEGRADED_MODEL = os.getenv("DEGRADED_MODEL", "mistral-small-latest")
+
+# Degradation stages; each stage also applies the ones before it
+STAGE_NORMAL = 0
+STAGE_SKIP_FACT_CHECKS = 1
+STAGE_SHRINK_CONTEXT = 2
+STAGE_LIMIT_OUTPUT = 3
+STAGE_SMALL_MODEL = 4
+STAGE_NAMES = ("normal", "skip fact checks", "shrink context", "limit output", "small model")
+
+class DegradationController:
+    """
+    Trades reply quality for speed under load. Watches the scheduler's
+    interactive queue depth and how long replies recently waited for a slot,
+    and steps up a stage as soon as either
+    passes that stage's threshold; steps back down one stage at a time once
+    load has stayed lower for the cooldown.
+    """
+    
+    def __init__(self, scheduler, queue_thresholds=DEGRADE_QUEUE_THRESHOLDS,
+                 wait_thresholds=DEGRADE_WAIT_THRESHOLDS, cooldown=DEGRADE_COOLDOWN):
+        self.scheduler = scheduler
+        self.queue_thresholds = queue_thresholds
+        self.wait_thresholds = wait_thresholds
+        self.cooldown = cooldown
+        self.stage = STAGE_NORMAL
+        self.changed_at = time.monotonic()
+        self.stage_changes = defaultdict(int)  # (from stage, to stage) -> count
+        self._waits = deque(maxlen=100)  # (admitted at, seconds waited)
+    
+    def observe(self, wait):
+        """Record how long a reply waited for a scheduler slot"""
+        self._waits.append((time.monotonic(), wait))
+    
+    def recent_wait(self):
+        """Median slot wait of the replies in the wait window, or 0 if there were none"""
+        cutoff = time.monotonic() - DEGRADE_WAIT_WINDOW
+        recent = sorted(wait for admitted, wait in self._waits if admitted >= cutoff)
+        return recent[len(recent) // 2] if recent else 0
+    
+    def target_stage(self, queue_depth, wait):
+        stage = STAGE_NORMAL
+        for i, (max_queue, max_wait) in enumerate(zip(self.queue_thresholds, self.wait_thresholds), 1):
+            if queue_depth >= max_queue or wait >= max_wait:
+                stage = i
+        return stage
+    
+    def update(self):
+        """Re-evaluate the load and return the stage to apply to the next request"""
+        # Background work (summaries, opening variants) waits without delaying replies
+        queue_depth = self.scheduler.queue_depth(PRIORITY_INTERACTIVE)
+        wait = self.recent_wait()
+        target = self.target_stage(queue_depth, wait)
+        now = time.monotonic()
+        if target > self.stage:
+            new_stage = target
+        elif target < self.stage and now - self.changed_at >= self.cooldown:
+            new_stage = self.stage - 1
+        else:
+            return self.stage
+        
+        print(f"Degradation stage {STAGE_NAMES[self.stage]} -> {STAGE_NAMES[new_stage]} "
+              f"(queue depth {queue_depth}, slot wait {wait:.1f}s)")
+        self.stage_changes[(self.stage, new_stage)] += 1
+        self.stage = new_stage
+        self.changed_at = now
+        return new_stage
+    
+    def stats(self):
+        return {
+            "stage": STAGE_NAMES[self.stage],
+            "stage_changes": {f"{STAGE_NAMES[a]} -> {STAGE_NAMES[b]}": count for (a, b), count in self.stage_changes.items()}
+        }
+
+# Model used for each routing tier, smallest first
+MODEL_TIERS = {
+    "small": os.getenv("MODEL_TIER_SMALL", "mistral-small-latest"),
+    "medium": os.getenv("MODEL_TIER_MEDIUM", "mistral-medium-latest"),
+    "large": os.getenv("MODEL_TIER_LARGE", MISTRAL_MODEL)
+}
+# Checked in order; the first rule whose conditions all match picks the tier.
+# Conditions: task and level (a value or a list), min_input_tokens, max_input_tokens.
+DEFAULT_ROUTING_RULES = [
+    {"task": "summary", "tier": "small"},
+    {"task": "persona", "tier": "medium"},
+    {"task": "rebuttal", "level": "beginner", "tier": "small"},
+    {"task": "rebuttal", "max_input_tokens": 25, "tier": "medium"},
+    {"tier": "large"}
+]
+# Seconds each task should take; tiers whose median latency misses the target are skipped
+DEFAULT_LATENCY_TARGETS = {"opening": 20, "rebuttal": 10, "persona": 30, "summary": 60}
+# Only latencies from this many recent seconds count against a tier, so a slow spell wears off
+ROUTER_LATENCY_WINDOW = float(os.getenv("ROUTER_LATENCY_WINDOW", "300"))
+# JSON file with "tiers", "rules" and/or "latency_targets" overriding the defaults
+MODEL_ROUTING_PATH = os.getenv("MODEL_ROUTING_PATH", "model_routing.json")
+
+class ModelRouter:
+    """
+    Picks a model tier for each Mistral request from its task (opening,
+    rebuttal, persona, summary), debate level and input size, then steps
+    down to a smaller tier if the chosen one has recently been too slow for
+    the task's latency target. Records latency and token usage per tier,
+    plus the "degraded" model used under load, which is never routed to.
+    """
+    
+    def __init__(self, path=MODEL_ROUTING_PATH, latency_window=ROUTER_LATENCY_WINDOW):
+        self.tiers = dict(MODEL_TIERS)
+        self.rules = list(DEFAULT_ROUTING_RULES)
+        self.latency_targets = dict(DEFAULT_LATENCY_TARGETS)
+        self._load_config(path)
+        self.latency_window = latency_window
+        self.models = {**self.tiers, "degraded": DEGRADED_MODEL}
+        # Maps tier -> (finished_at, latency) for recent requests, oldest first
+        self.latencies = {tier: deque(maxlen=200) for tier in self.models}
+        self.usage = {tier: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0} for tier in self.models}
+    
+    def _load_config(self, path):
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+            self.tiers.update(config.get("tiers", {}))
+            self.rules = config.get("rules", self.rules)
+            self.latency_targets.update(config.get("latency_targets", {}))
+        except Exception as e:
+            print(f"Error loading model routing config: {e}")
+    
+    @staticmethod
+    def _matches(rule, task, level, input_tokens):
+        for field, value in (("task", task), ("level", level)):
+            expected = rule.get(field)
+            if expected is not None and value not in (expected if isinstance(expected, list) else [expected]):
+                return False
+        if input_tokens < rule.get("min_input_tokens", 0):
+            return False
+        return input_tokens <= rule.get("max_input_tokens", float("inf"))
+    
+    def route(self, task, level=None, input_tokens=0):
+        """Return (tier, model) for a request"""
+        tier = next((rule["tier"] for rule in self.rules if self._matches(rule, task, level, input_tokens)), "large")
+        
+        # Fall back to smaller tiers while the chosen one is running slower than the target.
+        # A skipped tier gets no new samples, so its old ones must age out for it to be tried again.
+        target = self.latency_targets.get(task)
+        order = list(self.tiers)
+        i = order.index(tier) if tier in order else len(order) - 1
+        while target and i > 0 and latency_summary(self._recent_latencies(order[i])).get("p50", 0) > target:
+            i -= 1
+        return order[i], self.tiers[order[i]]
+    
+    def _recent_latencies(self, tier):
+        cutoff = time.time() - self.latency_window
+        return [latency for finished_at, latency in self.latencies[tier] if finished_at >= cutoff]
+    
+    def record(self, tier, latency, usage=None):
+        """Record a finished request's latency and, if the response reported it, token usage"""
+        if tier not in self.usage:
+            return
+        self.latencies[tier].append((time.time(), latency))
+        self.usage[tier]["calls"] += 1
+        if usage is not None:
+            self.usage[tier]["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            self.usage[tier]["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+    
+    def stats(self):
+        """Model, recent latency and token usage for each tier"""
+        return {
+            tier: {"model": model, "latency": latency_summary(self._recent_latencies(tier)), **self.usage[tier]}
+            for tier, model in self.models.items()
+        }
+
+# Openings kept per (article, figure, level), so repeat debaters don't all see the same one
+OPENING_CACHE_VARIANTS = int(os.getenv("OPENING_CACHE_VARIANTS", "3"))
+OPENING_CACHE_SIZE = int(os.getenv("OPENING_CACHE_SIZE", "512"))
+
+class OpeningCache(TTLCache):
+    """
+    Opening positions keyed by article, figure and level. Each entry holds a
+    few variants and expires NEWS_CACHE_TTL seconds after its first opening
+    was written, however long the article itself stays in the headline pool.
+    """
+    
+    def __init__(self, ttl=NEWS_CACHE_TTL, max_size=OPENING_CACHE_SIZE, variants=OPENING_CACHE_VARIANTS):
+        super().__init__(ttl, max_size)
+        self.variants = variants
+    
+    @staticmethod
+    def key(article, figure_id, level):
+        """
+        Cache key for an opening on an article, by the article's URL, or None
+        for articles without one (e.g. the placeholder used when NewsAPI fails)
+        """
+        url = article.get("url")
+        if not url:
+            return None
+        return (hashlib.sha1(url.encode("utf-8")).hexdigest(), figure_id or None, level)
+    
+    def add(self, key, opening):
+        """Add a variant, keeping the entry's original expiry"""
+        variants = self.peek(key)
+        if variants is None:
+            self.set(key, [opening])
+        elif len(variants) < self.variants and opening not in variants:
+            variants.append(opening)
+    
+    def needs_variants(self, key):
+        variants = self.peek(key)
+        return variants is not None and len(variants) < self.variants
+
 class MistralAgent:
     def __init__(self):
         MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
@@ -411,12 +2317,34 @@ class MistralAgent:
         self.user_debate_levels = {}
         # Add email manager
         self.email_manager = EmailManager()
+        # Fact-check verdicts that arrived after the reply, keyed by user ID
+        self.pending_fact_checks = {}
+        self.stream = MISTRAL_STREAM
+        # Every Mistral call waits its turn here
+        self.scheduler = LLMScheduler()
+        # Cheaper, faster replies while the scheduler is overloaded
+        self.degradation = DegradationController(self.scheduler)
+        # Picks the model for each request
+        self.router = ModelRouter()
+        # Opening positions shared by debates on the same article, figure and level
+        self.opening_cache = OpeningCache()
+        self._opening_fills = {}
+        # Keeps each user's conversation under the prompt token budget
+        self.context_window = ContextWindow()
+        # Running summary of each user's evicted turns, kept as one system message
+        self.summary_messages = {}
+        self._summary_backlog = defaultdict(list)
+        self._summary_tasks = {}
+        # Past messages of each user's conversation, searchable for long-range recall
+        self.transcripts = defaultdict(TranscriptIndex)
+        # Time-to-first-token and total latency of each debate reply, in seconds
+        self.response_latency = deque(maxlen=1000)
     
     def _get_user_conversation(self, user_id):
         """Get conversation history for a specific user, creating it if needed"""
         if user_id not in self.user_conversations:
             self.user_conversations[user_id] = [
-                {"role": "system", "content": SYSTEM_PROMPT}
+                {"role": "system", "content": self.historical_figures.prompts.get(None, self._get_user_debate_level(user_id))}
             ]
         return self.user_conversations[user_id]
     
@@ -426,105 +2354,36 @@ class MistralAgent:
     
     def _get_user_debate_level(self, user_id):
         """Get debate level for a specific user, defaulting to 'intermediate'"""
-        return self.user_debate_levels.get(user_id, "intermediate")
+        return self.user_debate_levels.get(user_id, DEFAULT_DEBATE_LEVEL)
     
     def set_debate_level(self, level, user_id):
         """Set the unified debate level for a specific user"""
-        valid_levels = ["beginner", "intermediate", "advanced"]
-        if level.lower() in valid_levels:
+        if level.lower() in DEBATE_LEVELS:
             self.user_debate_levels[user_id] = level.lower()
             return True
         return False
     
     def get_debate_level_description(self, user_id=None):
         """Get a description of the current debate level for a user"""
-        level = self.user_debate_levels.get(user_id, "intermediate") if user_id else "intermediate"
-        
-        descriptions = {
-            "beginner": {
-                "name": "Beginner",
-                "difficulty": "Easy - I'll be more willing to concede points and use gentler counterarguments",
-                "complexity": "High School level vocabulary and straightforward reasoning",
-                "point_multiplier": 0.8,
-                "features": [
-                    "Simpler vocabulary and sentence structure",
-                    "More willing to acknowledge your points",
-                    "Clearer explanations with concrete examples",
-                    "Less aggressive challenging of your arguments"
-                ]
-            },
-            "intermediate": {
-                "name": "Intermediate",
-                "difficulty": "Normal - I'll present balanced arguments with moderate intensity",
-                "complexity": "College level vocabulary and nuanced reasoning",
-                "point_multiplier": 1.0,
-                "features": [
-                    "Moderate vocabulary and some specialized terms",
-                    "Balanced approach to counterarguments",
-                    "Mix of theoretical concepts and practical examples",
-                    "Firm defense of position with occasional concessions"
-                ]
-            },
-            "advanced": {
-                "name": "Advanced",
-                "difficulty": "Hard - I'll aggressively defend my position and thoroughly challenge yours",
-                "complexity": "Professor level vocabulary with sophisticated reasoning",
-                "point_multiplier": 1.2,
-                "features": [
-                    "Advanced vocabulary and complex sentence structures",
-                    "Aggressive defense of position with minimal concessions",
-                    "Sophisticated arguments drawing on multiple disciplines",
-                    "Rigorous challenging of your arguments' premises and logic"
-                ]
-            }
-        }
-        return descriptions.get(level, descriptions["intermediate"])
+        level = self.user_debate_levels.get(user_id, DEFAULT_DEBATE_LEVEL) if user_id else DEFAULT_DEBATE_LEVEL
+        return LEVEL_DESCRIPTIONS.get(level, LEVEL_DESCRIPTIONS[DEFAULT_DEBATE_LEVEL])
     
     def _get_level_instructions(self, user_id):
         """Get system instructions for a user's current debate level"""
         level = self._get_user_debate_level(user_id)
-        
-        instructions = {
-            "beginner": """
-DEBATE LEVEL: BEGINNER
-- Use vocabulary and sentence structures accessible to high school students
-- Present your arguments clearly with straightforward reasoning
-- Be somewhat willing to acknowledge the validity of the user's points
-- Provide concrete examples and simple analogies
-- Challenge the user's arguments gently, focusing on major flaws
-- Keep sentences relatively short and direct
-""",
-            "intermediate": """
-DEBATE LEVEL: INTERMEDIATE
-- Use vocabulary and sentence structures appropriate for college-educated adults
-- Present nuanced arguments that consider multiple perspectives
-- Maintain your position firmly but acknowledge reasonable points
-- Balance theoretical concepts with practical examples
-- Challenge the user's arguments directly but respectfully
-- Use moderately complex sentence structures and rhetorical techniques
-""",
-            "advanced": """
-DEBATE LEVEL: ADVANCED
-- Use advanced vocabulary, complex sentence structures, and sophisticated rhetorical techniques
-- Present complex, multi-layered arguments drawing on interdisciplinary knowledge
-- Aggressively defend your position with minimal concessions
-- Make nuanced distinctions and address subtle counterarguments
-- Rigorously challenge the premises and logic of the user's arguments
-- Use abstract reasoning and hypothetical scenarios to strengthen your position
-"""
-        }
-        return instructions.get(level, instructions["intermediate"])
+        return LEVEL_INSTRUCTIONS.get(level, LEVEL_INSTRUCTIONS[DEFAULT_DEBATE_LEVEL])
     
     def set_historical_figure(self, figure_id, user_id):
         """Set the bot to speak as a historical figure for a specific user"""
         figure = self.historical_figures.get_figure_details(figure_id)
         if figure:
             # Update the system prompt with the historical figure's instructions
-            new_prompt = self.historical_figures.get_prompt_for_figure(figure_id)
+            new_prompt = self.historical_figures.get_prompt_for_figure(figure_id, self._get_user_debate_level(user_id))
             # Reset this user's conversation with new prompt
             self.user_conversations[user_id] = [
                 {"role": "system", "content": new_prompt}
             ]
+            self._reset_context(user_id)
             self.user_figures[user_id] = figure
             return True
         return False
@@ -532,23 +2391,31 @@ DEBATE LEVEL: ADVANCED
     def reset_persona(self, user_id):
         """Reset to default debate persona for a specific user"""
         self.user_conversations[user_id] = [
-            {"role": "system", "content": SYSTEM_PROMPT}
+            {"role": "system", "content": self.historical_figures.prompts.get(None, self._get_user_debate_level(user_id))}
         ]
+        self._reset_context(user_id)
         if user_id in self.user_figures:
             del self.user_figures[user_id]
     
-    async def fact_check_and_respond(self, message: discord.Message):
-        """Check facts in user message, then respond with debate points"""
+    async def fact_check_and_respond(self, message: discord.Message, on_delta=None, content=None, task="rebuttal"):
+        """
+        Check facts in user message, then respond with debate points.
+        If given, on_delta is called with the reply so far as it streams in,
+        and content replaces the message's text (e.g. several merged messages).
+        task ("opening" or "rebuttal") is used to pick the model.
+        """
         user_id = message.author.id
+        content = content or message.content
+        stage = self.degradation.update()
         
-        # Extract claims from the user's message
-        claims = self.fact_checker.extract_claims(message.content)
+        # Extract claims from the user's message, unless we're too busy to check them
+        claims = self.fact_checker.extract_claims(content) if stage < STAGE_SKIP_FACT_CHECKS else []
         fact_check_results = []
         
-        # Perform fact checking if claims were found
+        # Perform fact checking if claims were found, checking all claims concurrently
         if claims:
-            for claim in claims:
-                result = await self.fact_checker.check_claim(claim)
+            results = await self.fact_checker.check_claims(claims)
+            for claim, result in zip(claims, results):
                 if result["success"]:
                     fact_check_results.append({
                         "claim": claim,
@@ -560,98 +2427,398 @@ DEBATE LEVEL: ADVANCED
         conversation = self._get_user_conversation(user_id)
         
         # Add the user message to conversation history
-        conversation.append({"role": "user", "content": message.content})
-        
-        # If we have fact check results, add them as a system message
-        if fact_check_results:
-            # Check if we're debating as a historical figure
-            persona_reminder = ""
-            user_figure = self._get_user_figure(user_id)
-            if user_figure:
-                persona_reminder = f"IMPORTANT: You are speaking as {user_figure['name']}. Maintain this historical figure's voice, style, and perspective completely while addressing these claims."
-            
-            # Add complexity reminder
-            complexity_reminder = self._get_level_instructions(user_id)
-            
-            system_msg = f"{persona_reminder}\n{complexity_reminder}\nThe user made some factual claims. Here are the fact check results you should consider in your response:\n"
-            for i, check in enumerate(fact_check_results, 1):
-                system_msg += f"Claim: \"{check['claim']}\"\n"
-                system_msg += f"Verdict: {check['verdict']}\n"
-                system_msg += f"Address this claim in a way that's consistent with your character's worldview and knowledge. " \
-                              f"If the claim is False or Partly True, challenge it. If True, you may still interpret it through your historical lens.\n\n"
-            
-            conversation.append({"role": "system", "content": system_msg})
+        user_message = {"role": "user", "content": content}
+        conversation.append(user_message)
         
-        # Get response from Mistral
-        response = await self.client.chat.complete_async(
-            model=MISTRAL_MODEL,
-            messages=conversation,
-        )
+        # Drop the oldest turns if the prompt has outgrown its token budget
+        self._fit_context(user_id, conversation, stage)
         
-        # Extract the assistant's message
-        assistant_message = response.choices[0].message
+        # Get response from Mistral, with this turn's guidance and fact check results
+        # and a reminder of relevant earlier turns
+        guidance = self._turn_guidance(user_id, fact_check_results)
+        response = await self._chat(self._build_prompt(user_id, conversation, guidance, stage), on_delta, user_id, guild_id_of(message), stage, task)
         
         # Add the assistant's response to conversation history
-        conversation.append({"role": "assistant", "content": assistant_message.content})
+        assistant_message = {"role": "assistant", "content": response}
+        conversation.append(assistant_message)
+        self.transcripts[user_id].add(user_message)
+        self.transcripts[user_id].add(assistant_message)
         
         # If we have fact check results, prepare them for display
         fact_check_display = ""
         if fact_check_results:
-            fact_check_display = "\n\n**Fact Check Results:**\n"
-            for i, check in enumerate(fact_check_results, 1):
-                fact_check_display += f"📊 **Claim {i}**: \"{check['claim']}\"\n"
-                verdict_emoji = "✅" if check['verdict'] == "True" else "❌" if check['verdict'] == "False" else "⚠️"
-                fact_check_display += f"{verdict_emoji} **Verdict**: {check['verdict']}\n\n"
+            fact_check_display = "\n\n**Fact Check Results:**\n" + format_fact_check_results(fact_check_results)
         
         # Return both the bot's response and the fact check display
         return {
-            "response": assistant_message.content,
-            "fact_check": fact_check_display if fact_check_results else None
+            "response": response,
+            "fact_check": fact_check_display if fact_check_results else None,
+            "stage": stage
         }
     
+    def _fact_check_guidance(self, fact_check_results, previous_turn=False):
+        """Describe fact-check verdicts for the model"""
+        where = " in their previous message" if previous_turn else ""
+        guidance = f"The user made some factual claims{where}. Here are the fact check results you should consider in your response:\n"
+        for i, check in enumerate(fact_check_results, 1):
+            guidance += f"Claim: \"{check['claim']}\"\n"
+            guidance += f"Verdict: {check['verdict']}\n"
+            guidance += f"Address this claim in a way that's consistent with your character's worldview and knowledge. " \
+                        f"If the claim is False or Partly True, challenge it. If True, you may still interpret it through your historical lens.\n\n"
+        return guidance
+
+    def _turn_guidance(self, user_id, fact_check_results=None, previous_results=None):
+        """
+        Build the system message guiding the next reply: persona reminder and
+        fact-check verdicts, or None if there's nothing to add. It's sent with
+        that one request and never stored in the conversation. Level
+        instructions are part of the shared system prompt.
+        """
+        guidance = []
+        reminder = self.reinforce_persona(user_id)
+        user_figure = self._get_user_figure(user_id)
+        if reminder:
+            guidance.append(reminder["content"])
+        elif user_figure and (fact_check_results or previous_results):
+            guidance.append(f"IMPORTANT: You are speaking as {user_figure['name']}. Maintain this historical figure's voice, style, and perspective completely while addressing these claims.")
+        
+        if previous_results:
+            guidance.append(self._fact_check_guidance(previous_results, previous_turn=True))
+        if fact_check_results:
+            guidance.append(self._fact_check_guidance(fact_check_results))
+        if not guidance:
+            return None
+        return {"role": "system", "content": "\n".join(guidance)}
+
+    def _fit_context(self, user_id, conversation, stage=STAGE_NORMAL):
+        """
+        Keep a conversation under its token budget. Evicted turns are queued
+        for the background summarizer; the caller never waits for it. Under
+        load the queue is kept until the summarizer can run without adding to it.
+        """
+        evicted = self.context_window.fit(user_id, conversation)
+        if evicted:
+            self._summary_backlog[user_id].extend(evicted)
+        if stage >= STAGE_SHRINK_CONTEXT or not self._summary_backlog.get(user_id):
+            return
+        task = self._summary_tasks.get(user_id)
+        if task is None or task.done():
+            self._summary_tasks[user_id] = asyncio.ensure_future(self._summarize(user_id, conversation))
+
+    async def _summarize(self, user_id, conversation):
+        """Fold queued evicted turns into the conversation's running summary"""
+        while self._summary_backlog.get(user_id):
+            evicted = self._summary_backlog.pop(user_id)
+            transcript = "\n".join(
+                f"{'User' if message['role'] == 'user' else 'You'}: {message['content']}"
+                for message in evicted if message["role"] in ("user", "assistant")
+            )
+            if not transcript:
+                continue
+            
+            summary_message = self.summary_messages.get(user_id)
+            prompt = "Update the running summary of a debate with the turns below. " \
+                     "Keep the debate topic, each side's position, the key arguments and any claims that were fact checked. " \
+                     "Reply with only the updated summary, in under 150 words.\n\n"
+            if summary_message:
+                prompt += f"Current summary:\n{summary_message['content']}\n\n"
+            prompt += f"New turns:\n{transcript}"
+            
+            tier, model = self.router.route("summary", self._get_user_debate_level(user_id), estimate_tokens(prompt))
+            try:
+                async with self.scheduler.slot(PRIORITY_BACKGROUND, user_id):
+                    started = time.monotonic()
+                    response = await self.client.chat.complete_async(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        max_tokens=SUMMARY_MAX_TOKENS
+                    )
+                    self.router.record(tier, time.monotonic() - started, getattr(response, "usage", None))
+                summary = response.choices[0].message.content.strip()
+            except Exception as e:
+                print(f"Error summarizing conversation: {e}")
+                return
+            
+            # The debate may have been reset while the summary was being written
+            if self.user_conversations.get(user_id) is not conversation:
+                return
+            content = f"Summary of the debate so far:\n{summary}"
+            if summary_message and any(message is summary_message for message in conversation):
+                summary_message["content"] = content
+            else:
+                summary_message = {"role": "system", "content": content}
+                head, _ = self.context_window.split_turns(conversation)
+                conversation.insert(len(head), summary_message)
+                self.summary_messages[user_id] = summary_message
+
+    def _reset_context(self, user_id):
+        """Forget a user's context window stats, running summary and late verdicts when a new debate starts"""
+        self.context_window.reset(user_id)
+        self.pending_fact_checks.pop(user_id, None)
+        task = self._summary_tasks.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        self._summary_backlog.pop(user_id, None)
+        self.summary_messages.pop(user_id, None)
+        self.transcripts.pop(user_id, None)
+
+    def _build_prompt(self, user_id, conversation, guidance, stage=STAGE_NORMAL):
+        """
+        Return the messages to send for this turn: the conversation with this
+        turn's guidance and any relevant earlier turns that are no longer in the
+        window inserted just before the newest user message. Neither is stored.
+        Under load (stage) the oldest turns are left out of the prompt, though
+        not the stored conversation, and nothing is recalled.
+        """
+        shrink = stage >= STAGE_SHRINK_CONTEXT
+        if shrink:
+            conversation = self.context_window.trimmed(conversation, DEGRADED_CONTEXT_TOKEN_BUDGET)
+        latest = max(i for i, message in enumerate(conversation) if message["role"] == "user")
+        transient = []
+        recalled = None if shrink else self.transcripts[user_id].search(conversation[latest]["content"], exclude=conversation)
+        if recalled:
+            recall = "Relevant points from earlier in this debate:\n"
+            for message in recalled:
+                speaker = "User" if message["role"] == "user" else "You"
+                recall += f"{speaker}: {message['content'][:TRANSCRIPT_RECALL_MAX_CHARS]}\n"
+            transient.append({"role": "system", "content": recall})
+        if guidance:
+            transient.append(guidance)
+        return conversation[:latest] + transient + conversation[latest:]
+
+    async def _chat(self, messages, on_delta=None, user_id=None, guild_id=None, stage=STAGE_NORMAL, task="rebuttal"):
+        """
+        Get a reply from Mistral through the scheduler, as an interactive call,
+        from the model the router picks for the task. With on_delta, the reply
+        is streamed and on_delta is called with the text so far after each
+        chunk; it must not block, since the scheduler slot is held meanwhile.
+        Records time-to-first-token and total latency either way,
+        including time spent waiting for a slot.
+        Under load (stage), replies are shorter and come from a smaller model.
+        """
+        if stage >= STAGE_SMALL_MODEL:
+            tier, model = "degraded", DEGRADED_MODEL
+        else:
+            # Route on the size of the newest user message - a one-liner doesn't need the biggest model
+            latest = next((message for message in reversed(messages) if message["role"] == "user"), None)
+            tier, model = self.router.route(task, self._get_user_debate_level(user_id), estimate_tokens(latest["content"]) if latest else 0)
+        request = {
+            "model": model,
+            "messages": messages
+        }
+        if stage >= STAGE_LIMIT_OUTPUT:
+            request["max_tokens"] = DEGRADED_MAX_TOKENS
+        
+        started = time.monotonic()
+        async with self.scheduler.slot(PRIORITY_INTERACTIVE, user_id, guild_id):
+            admitted = time.monotonic()
+            self.degradation.observe(admitted - started)
+            if not (self.stream and on_delta):
+                response = await self.client.chat.complete_async(**request)
+                content = response.choices[0].message.content
+                elapsed = time.monotonic() - started
+                self.response_latency.append({"first_token": elapsed, "total": elapsed})
+                self.router.record(tier, time.monotonic() - admitted, getattr(response, "usage", None))
+                return content
+            
+            content = ""
+            first_token = None
+            usage = None
+            response = await self.client.chat.stream_async(**request)
+            async for chunk in response:
+                # The final chunk carries the token usage
+                usage = getattr(chunk.data, "usage", None) or usage
+                delta = chunk.data.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                content += delta
+                on_delta(content)
+            self.router.record(tier, time.monotonic() - admitted, usage)
+        total = time.monotonic() - started
+        self.response_latency.append({"first_token": first_token if first_token is not None else total, "total": total})
+        return content
+
+    def response_latency_stats(self):
+        """Median and p95 time-to-first-token and total latency of debate replies, in seconds"""
+        if not self.response_latency:
+            return {"count": 0}
+        stats = {"count": len(self.response_latency)}
+        for field in ("first_token", "total"):
+            latencies = sorted(latency[field] for latency in self.response_latency)
+            stats[field] = {
+                "p50": latencies[len(latencies) // 2],
+                "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            }
+        return stats
+
+    def performance_stats(self):
+        """Latency, cache, scheduler and routing stats from every layer of the reply pipeline"""
+        return {
+            "replies": self.response_latency_stats(),
+            "scheduler": self.scheduler.stats(),
+            "degradation": self.degradation.stats(),
+            "routing": self.router.stats(),
+            "openings": self.opening_cache.stats(),
+            "fact_check_cache": self.fact_checker.cache_stats(),
+            "fact_check_verdicts": self.fact_checker.verdict_latency_stats(),
+            "fact_check_tiers": self.fact_checker.tier_latency_stats()
+        }
+
+    async def respond_then_fact_check(self, message: discord.Message, on_delta=None, content=None):
+        """
+        Respond to the user right away and fact check their claims in parallel.
+        Quick verdicts that land within their latency budget feed the reply;
+        the deep checks keep running and are returned as one in-flight task
+        per claim - pass them to iter_fact_checks to collect them as they finish.
+        If given, on_delta is called with the reply so far as it streams in,
+        and content replaces the message's text (e.g. several merged messages).
+        """
+        user_id = message.author.id
+        content = content or message.content
+        stage = self.degradation.update()
+        
+        # Start checking claims now so the checks overlap with the Mistral call
+        claims = self.fact_checker.extract_claims(content) if stage < STAGE_SKIP_FACT_CHECKS else []
+        quick_checks, checks = self.fact_checker.start_tiered_checks(claims)
+        
+        conversation = self._get_user_conversation(user_id)
+        
+        # Verdicts that finished after the previous reply become context for this one
+        previous_results = self.pending_fact_checks.pop(user_id, None)
+        
+        quick_results = [None] * len(claims)
+        current_results = []
+        if quick_checks:
+            for i, result in enumerate(await asyncio.gather(*quick_checks, return_exceptions=True)):
+                if isinstance(result, dict) and result["success"]:
+                    quick_results[i] = result
+            current_results = [
+                {"claim": claims[i], "verdict": result["verdict"]}
+                for i, result in enumerate(quick_results) if result
+            ]
+        
+        user_message = {"role": "user", "content": content}
+        conversation.append(user_message)
+        self._fit_context(user_id, conversation, stage)
+        
+        guidance = self._turn_guidance(user_id, current_results, previous_results)
+        response = await self._chat(self._build_prompt(user_id, conversation, guidance, stage), on_delta, user_id, guild_id_of(message), stage)
+        assistant_message = {"role": "assistant", "content": response}
+        conversation.append(assistant_message)
+        self.transcripts[user_id].add(user_message)
+        self.transcripts[user_id].add(assistant_message)
+        
+        return {
+            "response": response,
+            "claims": claims,
+            "quick_checks": quick_results,
+            "fact_checks": checks
+        }
+
+    async def iter_fact_checks(self, user_id, claims, checks, quick_results=None):
+        """
+        Yield (index, claim, result) for each fact check as it finishes.
+        Successful verdicts are kept as context for the user's next turn,
+        unless the reply already saw the same verdict from the quick tier
+        or the debate has been reset since.
+        """
+        conversation = self.user_conversations.get(user_id)
+        indexes = {check: i for i, check in enumerate(checks)}
+        pending = set(checks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for check in sorted(done, key=indexes.get):
+                i = indexes[check]
+                try:
+                    result = check.result()
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+                quick = quick_results[i] if quick_results else None
+                current = self.user_conversations.get(user_id) is conversation
+                if current and result["success"] and not (quick and quick["verdict"] == result["verdict"]):
+                    self.pending_fact_checks.setdefault(user_id, []).append({
+                        "claim": claims[i],
+                        "verdict": result["verdict"],
+                        "explanation": result["explanation"]
+                    })
+                yield i, claims[i], result
+
+    async def opening_position(self, message: discord.Message, article, figure_id=None):
+        """
+        Get the opening position for a debate set up by message. Openings are
+        cached per article, figure and level: a hit is served straight away
+        and added to the user's conversation, and more variants for the key
+        are written in the background until the cache holds enough.
+        """
+        user_id = message.author.id
+        key = self.opening_cache.key(article, figure_id, self._get_user_debate_level(user_id))
+        variants = self.opening_cache.get(key) if key else None
+        if not variants:
+            result = await self.fact_check_and_respond(message, task="opening")
+            # An opening cut short or written by a smaller model under load shouldn't be reused
+            if key and result["stage"] < STAGE_LIMIT_OUTPUT:
+                self.opening_cache.add(key, result["response"])
+            if result["fact_check"]:
+                return result["response"] + "\n" + result["fact_check"]
+            return result["response"]
+        
+        opening = random.choice(variants)
+        conversation = self._get_user_conversation(user_id)
+        user_message = {"role": "user", "content": message.content}
+        assistant_message = {"role": "assistant", "content": opening}
+        conversation.extend([user_message, assistant_message])
+        self.transcripts[user_id].add(user_message)
+        self.transcripts[user_id].add(assistant_message)
+        
+        if self.opening_cache.needs_variants(key) and key not in self._opening_fills:
+            self._opening_fills[key] = asyncio.ensure_future(
+                self._add_opening_variant(key, conversation[0]["content"], message.content, user_id)
+            )
+        return opening
+
+    async def _add_opening_variant(self, key, system_prompt, content, user_id):
+        """Write another opening for a cached key as background work"""
+        try:
+            messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": content}]
+            tier, model = self.router.route("opening", key[2], estimate_tokens(content))
+            async with self.scheduler.slot(PRIORITY_BACKGROUND, user_id):
+                started = time.monotonic()
+                response = await self.client.chat.complete_async(model=model, messages=messages)
+                self.router.record(tier, time.monotonic() - started, getattr(response, "usage", None))
+            self.opening_cache.add(key, response.choices[0].message.content)
+        except Exception as e:
+            print(f"Error generating opening variant: {e}")
+        finally:
+            self._opening_fills.pop(key, None)
+
     async def run(self, message: discord.Message):
-        """Legacy method for compatibility"""
-        result = await self.fact_check_and_respond(message)
+        """Legacy method for compatibility, used for the debate's opening position"""
+        result = await self.fact_check_and_respond(message, task="opening")
         if result["fact_check"]:
             return result["response"] + "\n" + result["fact_check"]
         return result["response"]
 
     def reinforce_persona(self, user_id):
         """
-        Reinforce the historical figure's persona during long debates
-        to prevent character drift for a specific user
+        Return a reminder to stay in the historical figure's persona during
+        long debates, or None. The reminder is per-turn guidance; it's sent
+        with the next request only, not stored in the conversation.
         """
         if user_id not in self.user_figures:
-            return  # No persona to reinforce
+            return None  # No persona to reinforce
         
         user_figure = self.user_figures[user_id]
         conversation = self._get_user_conversation(user_id)
         
         # Check if we have enough conversation history to need reinforcement
-        if len(conversation) >= 6:  # After a few exchanges
-            # Add a reminder to stay in character
-            reminder = {
-                "role": "system", 
-                "content": f"IMPORTANT REMINDER: You are {user_figure['name']}. Continue to speak authentically as this historical figure would, using their characteristic language, rhetorical style, and expressing their worldview. Maintain this persona completely in your next response."
-            }
-            
-            # Insert the reminder before the most recent user message
-            conversation.insert(-1, reminder)
-            
-            # Keep conversation history from growing too large
-            if len(conversation) > 10:
-                # Keep the system prompts, plus the 4 most recent messages
-                system_prompts = [msg for msg in conversation if msg["role"] == "system"]
-                recent_messages = conversation[-4:]
-                
-                # Reconstruct conversation with system prompts and recent messages
-                self.user_conversations[user_id] = []
-                # First add the initial system prompt (the persona)
-                self.user_conversations[user_id].append(system_prompts[0])
-                # Then add the personality reminder
-                self.user_conversations[user_id].append(reminder)
-                # Then add recent messages
-                self.user_conversations[user_id].extend(recent_messages)
+        if len(conversation) < 6:  # Not until after a few exchanges
+            return None
+        return {
+            "role": "system", 
+            "content": f"IMPORTANT REMINDER: You are {user_figure['name']}. Continue to speak authentically as this historical figure would, using their characteristic language, rhetorical style, and expressing their worldview. Maintain this persona completely in your next response."
+        }
 
 class DebateStatsTracker:
     def __init__(self, file_path="debate_stats.json"):
@@ -0,0 +1,154 @@
+"""
+Micro-benchmarks for EchoBreaker's hot paths.
+
+Usage:
+    python benchmarks.py
+"""
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from agent import ClaimExtractor, ContextWindow, MistralAgent, CLAIM_INDICATORS
+
+SAMPLE_SENTENCES = [
+    "According to the Bureau of Labor Statistics, unemployment in the U.S. rose to 3.9% in 2024",
+    "I just don't think that's a fair way to look at the problem",
+    "Studies show that 70% of Americans support stricter gun laws",
+    "Dr. King would never have endorsed that kind of rhetoric",
+    "Crime rates in major cities declined by 4.5 percent last year",
+    "You keep dodging my question about who pays for it",
+    "A recent Gallup poll found that trust in the media is at a record low",
+    "Honestly, the whole debate feels like it's missing the point",
+    "GDP grew 2.8% in 2023 while inflation fell to 3.4%",
+    "We should focus on what actually helps working families",
+]
+
+
+def legacy_extract_claims(text):
+    """The original split-on-period extractor, kept as the benchmark baseline"""
+    sentences = [s.strip() for s in text.split('.') if len(s.strip()) > 20]
+    claims = []
+    for sentence in sentences:
+        if any(indicator in sentence.lower() for indicator in CLAIM_INDICATORS):
+            claims.append(sentence)
+    return claims[:2]
+
+
+def make_messages(count, sentences_per_message, seed=153):
+    rng = random.Random(seed)
+    return [
+        ". ".join(rng.choice(SAMPLE_SENTENCES) for _ in range(sentences_per_message)) + "."
+        for _ in range(count)
+    ]
+
+
+def throughput(fn, messages, repeat=3):
+    """Best-of-N messages per second"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(messages)
+        best = min(best, time.perf_counter() - start)
+    return len(messages) / best
+
+
+def bench_claim_extraction():
+    extractor = ClaimExtractor()
+    print("Claim extraction throughput (messages/sec)")
+    print(f"{'sentences/msg':>14} {'legacy':>12} {'extractor':>12} {'speedup':>8}")
+    for sentences_per_message in (5, 50, 500):
+        messages = make_messages(2000 if sentences_per_message < 500 else 200, sentences_per_message)
+        legacy = throughput(lambda batch: [legacy_extract_claims(m) for m in batch], messages)
+        compiled = throughput(extractor.extract_batch, messages)
+        print(f"{sentences_per_message:>14} {legacy:>12,.0f} {compiled:>12,.0f} {compiled / legacy:>7.2f}x")
+
+
+FAKE_REPLY = ("That argument ignores the broader picture. " * 15).strip()
+
+
+class FakeMistralClient:
+    """Stands in for the Mistral client, recording the prompt sent on each debate turn"""
+
+    def __init__(self):
+        self.chat = self
+        self.prompts = []
+
+    async def complete_async(self, model, messages, **kwargs):
+        if messages[0]["content"].startswith("Update the running summary"):
+            content = "The user argued about economics and crime statistics."
+        else:
+            self.prompts.append(list(messages))
+            content = FAKE_REPLY
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def make_debate_agent(figure=None, token_budget=None):
+    agent = MistralAgent()
+    agent.client = FakeMistralClient()
+    if token_budget is not None:
+        agent.context_window = ContextWindow(token_budget=token_budget)
+
+    async def check_claims(claims):
+        return [{"success": True, "verdict": "Partly True", "explanation": ""} for _ in claims]
+    agent.fact_checker.check_claims = check_claims
+    if figure:
+        agent.set_historical_figure(figure, 1)
+    return agent
+
+
+def legacy_prompt_tokens(agent, messages):
+    """
+    Replay a debate the way fact_check_and_respond used to build prompts, with
+    persona reminders and fact-check guidance stored in the conversation
+    """
+    window = ContextWindow()
+    conversation = agent._get_user_conversation(1)
+    user_figure = agent._get_user_figure(1)
+    tokens = []
+    for content in messages:
+        if user_figure and len(conversation) >= 6:
+            reminder = agent.reinforce_persona(1)
+            conversation.insert(-1, reminder)
+            if len(conversation) > 10:
+                system_prompts = [msg for msg in conversation if msg["role"] == "system"]
+                conversation[:] = [system_prompts[0], reminder] + conversation[-4:]
+        conversation.append({"role": "user", "content": content})
+        claims = agent.fact_checker.extract_claims(content)
+        if claims:
+            persona = f"IMPORTANT: You are speaking as {user_figure['name']}. Maintain this historical figure's voice, style, and perspective completely while addressing these claims." if user_figure else ""
+            results = [{"claim": claim, "verdict": "Partly True"} for claim in claims]
+            conversation.append({"role": "system", "content": f"{persona}\n{agent._get_level_instructions(1)}\n{agent._fact_check_guidance(results)}"})
+        tokens.append(window.count_tokens(conversation))
+        conversation.append({"role": "assistant", "content": FAKE_REPLY})
+    return tokens
+
+
+def current_prompt_tokens(agent, messages):
+    """Play a debate through fact_check_and_respond, counting the tokens of each prompt sent"""
+    async def play():
+        for content in messages:
+            await agent.fact_check_and_respond(SimpleNamespace(content=content, author=SimpleNamespace(id=1)))
+    asyncio.run(play())
+    window = ContextWindow()
+    return [window.count_tokens(prompt) for prompt in agent.client.prompts]
+
+
+def bench_prompt_tokens(turns=20):
+    messages = make_messages(turns, 3)
+    for figure in (None, "churchill"):
+        stored = legacy_prompt_tokens(make_debate_agent(figure), messages)
+        transient = current_prompt_tokens(make_debate_agent(figure, token_budget=10 ** 9), messages)
+        budgeted = current_prompt_tokens(make_debate_agent(figure), messages)
+        print(f"Prompt tokens per turn over a {turns}-turn debate ({figure or 'default persona'})")
+        print(f"{'turn':>5} {'stored guidance':>16} {'transient':>10} {'+ budget':>9}")
+        for turn, row in enumerate(zip(stored, transient, budgeted), 1):
+            print(f"{turn:>5} {row[0]:>16,} {row[1]:>10,} {row[2]:>9,}")
+        print(f"{'total':>5} {sum(stored):>16,} {sum(transient):>10,} {sum(budgeted):>9,}")
+        print()
+
+
+if __name__ == "__main__":
+    bench_claim_extraction()
+    print()
+    bench_prompt_tokens()
@@ -10,7 +10,7 @@ import re
 
 from discord.ext import commands
 from dotenv import load_dotenv
-from agent import MistralAgent, NewsAgent, DebateStatsTracker, EmailManager
+from agent import MistralAgent, NewsAgent, HeadlinePrefetcher, DebateStatsTracker, EmailManager, TurnQueue, format_fact_check_results
 
 PREFIX = "!"
 
@@ -24,17 +24,40 @@ load_dotenv()
 # Create the bot with all intents
 # The message content and members intent must be enabled in the Discord Developer Portal for the bot to work.
 intents = discord.Intents.all()
-bot = commands.Bot(command_prefix=PREFIX, intents=intents)
+
+class DebateBot(commands.Bot):
+    async def close(self):
+        """Stop background work and close the pooled HTTP sessions before disconnecting"""
+        headline_prefetcher.stop()
+        if stats_log_task is not None:
+            stats_log_task.cancel()
+        await news_agent.close()
+        await debate_agent.fact_checker.close()
+        await super().close()
+
+bot = DebateBot(command_prefix=PREFIX, intents=intents)
 
 # Import the Mistral agent from the agent.py file
 news_agent = NewsAgent()
+headline_prefetcher = HeadlinePrefetcher(news_agent)
 debate_agent = MistralAgent()
+# One turn at a time per conversation, with quick follow-up messages merged in
+turn_queue = TurnQueue()
 
 # Get the token from the environment variables
 token = os.getenv("DISCORD_TOKEN")
 print(f"Token loaded: {'Yes' if token else 'No'}")
 print(f"Token length: {len(token) if token else 0}")
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "123456789012345678"))
+# Reply before fact checks finish and edit their verdicts in afterwards
+FACT_CHECK_PIPELINED = os.getenv("FACT_CHECK_PIPELINED", "true").lower() == "true"
+# Minimum seconds between edits of a streaming reply, to stay inside Discord's rate limits
+REPLY_EDIT_INTERVAL = float(os.getenv("REPLY_EDIT_INTERVAL", "1.0"))
+# Streaming replies roll over into a new message past this many characters
+REPLY_CHUNK_SIZE = 1900
+# Seconds between performance stats log lines; 0 turns them off
+STATS_LOG_INTERVAL = float(os.getenv("STATS_LOG_INTERVAL", "600"))
+stats_log_task = None
 
 # Track active debates
 active_debates = {}  # Maps initiator_id -> debate_info
@@ -59,6 +82,14 @@ async def on_ready():
     """
     logger.info(f"{bot.user} has connected to Discord!")
     
+    # Keep a warm pool of headlines for bare !debate commands
+    headline_prefetcher.start()
+    
+    # on_ready fires again after reconnects, so only start the stats logger once
+    global stats_log_task
+    if STATS_LOG_INTERVAL > 0 and (stats_log_task is None or stats_log_task.done()):
+        stats_log_task = asyncio.create_task(log_performance_stats())
+    
     # starts the conversation by greeting the user
     channel = bot.get_channel(CHANNEL_ID)
     if channel:
@@ -180,12 +211,27 @@ async def on_message(message: discord.Message):
             
         participant_data["points_accumulated"] += quality_points
         
-        # Reinforce the historical figure persona if one is being used
-        debate_agent.reinforce_persona(message.author.id)
+        # Answer this user's messages one turn at a time, merging any sent in quick succession
+        async with turn_queue.turn(message.author.id, message) as batch:
+            if batch is None:
+                return  # Merged into a turn that hasn't started yet
+            message = batch[-1]
+            content = "\n\n".join(m.content for m in batch)
+            reply = StreamingReply(message)
+            if FACT_CHECK_PIPELINED:
+                # Reply straight away and fill in the fact checks as they finish
+                response_data = await debate_agent.respond_then_fact_check(message, on_delta=reply.update, content=content)
+            else:
+                # Use the enhanced fact-checking response method
+                response_data = await debate_agent.fact_check_and_respond(message, on_delta=reply.update, content=content)
+            await reply.finish(response_data["response"])
+        
+        if FACT_CHECK_PIPELINED:
+            # The next turn can start while the fact checks finish
+            if response_data["claims"]:
+                await stream_fact_checks(message, participant_data, response_data)
+            return
         
-        # Use the enhanced fact-checking response method
-        response_data = await debate_agent.fact_check_and_respond(message)
-        response = response_data["response"]
         fact_check = response_data["fact_check"]
         
         # Award bonus points for accurate claims
@@ -193,15 +239,6 @@ async def on_message(message: discord.Message):
             participant_data["points_accumulated"] += 2
             fact_check += "\n*+2 points awarded for accurate claims!*"
         
-        # Send the response
-        if len(response) <= 2000:
-            await message.reply(response)
-        else:
-            # Split the response into chunks of 1900 characters
-            chunks = [response[i:i+1900] for i in range(0, len(response), 1900)]
-            for i, chunk in enumerate(chunks):
-                await message.channel.send(f"**Part {i+1}/{len(chunks)}**: {chunk}")
-        
         # If there's a fact check, send it as a separate embed
         if fact_check:
             fact_check_embed = discord.Embed(
@@ -212,6 +249,127 @@ async def on_message(message: discord.Message):
             fact_check_embed.set_footer(text="Powered by Perplexity AI")
             await message.channel.send(embed=fact_check_embed)
 
+def split_reply(text):
+    """
+    Split a reply into Discord-sized chunks, breaking at whitespace where possible.
+    A chunk only depends on the text before its end, so chunks stay put as the reply grows.
+    """
+    chunks = []
+    while len(text) > REPLY_CHUNK_SIZE:
+        cut = text.rfind(" ", 0, REPLY_CHUNK_SIZE)
+        if cut <= 0:
+            cut = REPLY_CHUNK_SIZE
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    """
+    A debate reply posted as soon as the first tokens arrive, then edited in
+    batches no more than once every REPLY_EDIT_INTERVAL seconds. Text past
+    Discord's message limit rolls over into follow-up messages.
+    Posting happens in a background task, so slow or rate-limited Discord
+    edits never hold up the LLM stream feeding the reply.
+    """
+    
+    def __init__(self, message):
+        self.message = message
+        self.sent = []  # (discord message, content) for each chunk posted so far
+        self.text = ""
+        self.posted = ""
+        self._finished = asyncio.Event()
+        self._poster = None
+    
+    def update(self, text):
+        """Record the reply so far, starting the background poster if it's idle"""
+        self.text = text
+        if self._poster is None and not self._finished.is_set():
+            self._poster = asyncio.ensure_future(self._post_periodically())
+    
+    async def _post_periodically(self):
+        # Stops once a whole interval passes with no new text, e.g. if the reply failed
+        try:
+            while self.text != self.posted and not self._finished.is_set():
+                await self.flush()
+                try:
+                    await asyncio.wait_for(self._finished.wait(), REPLY_EDIT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        except discord.HTTPException as e:
+            logger.warning(f"Error posting streamed reply: {e}")
+        finally:
+            self._poster = None
+    
+    async def finish(self, text):
+        """Post the complete reply"""
+        self._finished.set()
+        self.text = text
+        if self._poster is not None:
+            await self._poster
+        await self.flush()
+    
+    async def flush(self):
+        self.posted = self.text
+        if not self.text.strip():
+            return
+        for i, chunk in enumerate(split_reply(self.text)):
+            if i >= len(self.sent):
+                if i == 0:
+                    sent = await self.message.reply(chunk)
+                else:
+                    sent = await self.message.channel.send(chunk)
+                self.sent.append((sent, chunk))
+            elif self.sent[i][1] != chunk:
+                await self.sent[i][0].edit(content=chunk)
+                self.sent[i] = (self.sent[i][0], chunk)
+
+async def stream_fact_checks(message, participant_data, response_data):
+    """
+    Post a fact-check embed showing the quick verdicts, then edit it in place
+    as each claim's deep verdict arrives
+    """
+    checks = [{"claim": claim} for claim in response_data["claims"]]
+    verifying = bool(response_data["fact_checks"])
+    for check, quick in zip(checks, response_data["quick_checks"]):
+        if quick:
+            check["verdict"] = quick["verdict"]
+            if verifying and quick["tier"] == "quick":
+                check["tier"] = "quick"
+    bonus = 0
+    
+    def describe():
+        nonlocal bonus
+        description = "**Fact Check Results:**\n" + format_fact_check_results(checks)
+        
+        # Award bonus points for accurate claims, taking them back if a deep check overturns the quick one
+        new_bonus = 2 if any(check.get("verdict") == "True" for check in checks) else 0
+        participant_data["points_accumulated"] += new_bonus - bonus
+        bonus = new_bonus
+        if bonus:
+            description += "\n*+2 points awarded for accurate claims!*"
+        return description
+    
+    fact_check_embed = discord.Embed(
+        title="Fact Check Results",
+        description=describe(),
+        color=discord.Color.blue()
+    )
+    fact_check_embed.set_footer(text="Powered by Perplexity AI")
+    fact_check_message = await message.channel.send(embed=fact_check_embed)
+    
+    async for i, claim, result in debate_agent.iter_fact_checks(
+        message.author.id, response_data["claims"], response_data["fact_checks"], response_data["quick_checks"]
+    ):
+        checks[i].pop("tier", None)
+        if result["success"]:
+            checks[i]["verdict"] = result["verdict"]
+        elif not checks[i].get("verdict"):
+            checks[i]["status"] = "Could not be verified"
+        
+        fact_check_embed.description = describe()
+        await fact_check_message.edit(embed=fact_check_embed)
+
 # Commands
 @bot.command(name="debate", help="Start a political debate with the bot. Optional: [figure] [level] [topic]")
 async def debate(ctx, arg1=None, arg2=None, *, topic=None):
@@ -316,11 +474,11 @@ async def debate(ctx, arg1=None, arg2=None, *, topic=None):
     if topic:
         await ctx.send(f"Let's start a debate about {topic}! I'll find a relevant news article for us to discuss...")
         # Get an article related to the specified topic
-        top_article = news_agent.get_article_by_topic(topic)
+        top_article = await news_agent.get_article_by_topic_async(topic)
     else:
         await ctx.send("Let's start a debate! I'll find a current news article for us to discuss...")
-        # Pull a random top article from the news API
-        top_article = news_agent.get_top_article()
+        # Take the next headline from the prefetched pool, falling back to the news API
+        top_article = headline_prefetcher.next_article() or await news_agent.get_top_article_async()
 
     title = top_article["title"]
     author = top_article["author"] if top_article["author"] else "Unknown author"
@@ -346,8 +504,8 @@ async def debate(ctx, arg1=None, arg2=None, *, topic=None):
         author=ctx.author
     )
     
-    # Get the AI's opening position
-    opening_position = await debate_agent.run(setup_message)
+    # Get the AI's opening position, reusing one written for the same article, figure and level
+    opening_position = await debate_agent.opening_position(setup_message, top_article, figure.lower() if figure else None)
     
     # Truncate if too long
     if len(opening_position) > 1500:
@@ -501,6 +659,9 @@ async def enddebate(ctx, send_email: str = None):
     
     # Reset agent's persona for each participant
     for participant_id in all_participants:
+        context_stats = debate_agent.context_window.get_stats(participant_id)
+        if context_stats["turns_evicted"]:
+            logger.info(f"Context evictions for {participant_id} in {debate_id}: {context_stats}")
         debate_agent.reset_persona(participant_id)
     
     # Award bonus points to the winner (if a human won)
@@ -720,6 +881,30 @@ async def show_stats(ctx, member: discord.Member = None):
     embed = create_stats_embed(target, stats)
     await ctx.send(embed=embed)
 
+async def log_performance_stats():
+    """Periodically log latency, cache and scheduler stats for the LLM and fact-check pipeline"""
+    while True:
+        await asyncio.sleep(STATS_LOG_INTERVAL)
+        try:
+            logger.info(f"Performance stats: {json.dumps(debate_agent.performance_stats())}")
+        except Exception as e:
+            logger.error(f"Error logging performance stats: {e}")
+
+@bot.command(name="botstats", help="(Admin) Show latency, cache and scheduler stats.")
+@commands.has_permissions(administrator=True)
+async def show_bot_stats(ctx):
+    """Post the bot's performance stats as JSON, split to fit Discord's message limit."""
+    text = json.dumps(debate_agent.performance_stats(), indent=2)
+    for chunk in split_reply(text):
+        await ctx.send(f"```json\n{chunk}\n```")
+
+@show_bot_stats.error
+async def show_bot_stats_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("Only server administrators can view bot stats.")
+    else:
+        raise error
+
 @bot.command(name="leaderboard", aliases=["lb"], help="View the debate points leaderboard.")
 async def leaderboard(ctx):
     """Show the top 10 users by debate points."""
@@ -850,7 +1035,8 @@ async def create_custom_figure(ctx, *, figure_name):
         
         # Generate the custom figure
         figure_key, figure_data = await debate_agent.historical_figures.generate_custom_figure(
-            figure_name, debate_agent.client
+            figure_name, debate_agent.client, debate_agent.scheduler,
+            user_id=ctx.author.id, guild_id=ctx.guild.id if ctx.guild else None, router=debate_agent.router
         )
         
         if not figure_key:
@@ -0,0 +1,57 @@
+"""
+Train the check-worthiness model from logged fact-check verdicts.
+
+Every fresh Perplexity verdict is appended to claim_verdicts.jsonl. This
+script holds out part of that log, reports precision and recall of the
+trained model against the untrained (indicator heuristic) weights, and
+saves the trained weights where FactChecker loads them on startup.
+
+Usage:
+    python train_checkworthiness.py [--test-fraction 0.2] [--epochs 5] [--dry-run]
+"""
+import argparse
+import random
+
+from agent import (
+    CheckWorthinessModel, load_claim_log,
+    CLAIM_LOG_PATH, CHECKWORTHINESS_MODEL_PATH, CHECKWORTHINESS_THRESHOLD
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=CLAIM_LOG_PATH)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=CHECKWORTHINESS_THRESHOLD)
+    parser.add_argument("--dry-run", action="store_true", help="Report metrics without saving the model")
+    args = parser.parse_args()
+
+    examples = load_claim_log(args.log)
+    if len(examples) < 20:
+        print(f"Only {len(examples)} logged verdicts in {args.log} - collect more before training.")
+        return
+
+    random.Random(153).shuffle(examples)
+    split = int(len(examples) * (1 - args.test_fraction))
+    train, test = examples[:split], examples[split:]
+    useful = sum(label for _, _, label in examples)
+    print(f"{len(examples)} logged verdicts ({useful} useful), training on {len(train)}, testing on {len(test)}")
+
+    # The untrained model reproduces the indicator heuristic
+    baseline = CheckWorthinessModel(path=None)
+    model = CheckWorthinessModel(path=None)
+    model.train(train, epochs=args.epochs)
+
+    for name, candidate in (("heuristic", baseline), ("trained", model)):
+        metrics = candidate.evaluate(test, threshold=args.threshold)
+        print(f"{name:>10}: precision {metrics['precision']:.3f}  recall {metrics['recall']:.3f}")
+
+    if not args.dry_run:
+        model.path = CHECKWORTHINESS_MODEL_PATH
+        model.save()
+        print(f"Saved model to {model.path}")
+
+
+if __name__ == "__main__":
+    main()